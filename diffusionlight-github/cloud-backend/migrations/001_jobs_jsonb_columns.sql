@@ -0,0 +1,7 @@
+-- Store job configuration and result files as native JSONB.
+-- New databases get these types from db.create_all(); run this once against
+-- existing deployments (Supabase SQL editor or psql).
+
+ALTER TABLE jobs
+    ALTER COLUMN configuration TYPE jsonb USING configuration::jsonb,
+    ALTER COLUMN result_files TYPE jsonb USING result_files::jsonb;
@@ -0,0 +1,5 @@
+-- Index for the job list ordering (GET /api/jobs).
+-- CONCURRENTLY avoids locking writes; run outside a transaction.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS jobs_created_at_desc_idx
+    ON jobs (created_at DESC);
@@ -0,0 +1,7 @@
+-- Keyset pagination for GET /api/jobs orders by (created_at DESC, id DESC).
+-- Replaces the single-column index from 002. Run outside a transaction.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS jobs_created_at_id_desc_idx
+    ON jobs (created_at DESC, id DESC);
+
+DROP INDEX CONCURRENTLY IF EXISTS jobs_created_at_desc_idx;
@@ -0,0 +1,9 @@
+-- Status indexes for /api/statistics and status-filtered job lists.
+-- Run outside a transaction.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS jobs_status_created_at_idx
+    ON jobs (status, created_at DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS jobs_active_idx
+    ON jobs (created_at DESC)
+    WHERE status IN ('pending', 'processing');
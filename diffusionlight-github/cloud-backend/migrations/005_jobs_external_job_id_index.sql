@@ -0,0 +1,5 @@
+-- Webhooks look jobs up by their RunPod job id. Run outside a transaction.
+-- Fails if duplicate external_job_id values exist; resolve those first.
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS jobs_external_job_id_idx
+    ON jobs (external_job_id);
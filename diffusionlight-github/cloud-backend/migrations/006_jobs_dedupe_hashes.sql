@@ -0,0 +1,8 @@
+-- Input/configuration hashes for reusing the results of identical jobs.
+-- Run outside a transaction.
+
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS input_hash VARCHAR(64);
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS config_hash VARCHAR(64);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS jobs_dedupe_idx
+    ON jobs (input_hash, config_hash, status);
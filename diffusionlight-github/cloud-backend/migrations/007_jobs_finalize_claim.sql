@@ -0,0 +1,3 @@
+-- Claim marker so only one finalize_hdri_task collects a job's results.
+
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS finalize_claimed_at TIMESTAMP;
@@ -1,4 +1,12 @@
 import os
+import time
+import base64
+import random
+import tempfile
+import functools
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
 from flask_sqlalchemy import SQLAlchemy
 from supabase import create_client, Client
 from dotenv import load_dotenv
@@ -13,39 +21,327 @@ supabase_url = os.getenv('SUPABASE_URL')
 supabase_key = os.getenv('SUPABASE_ANON_KEY')
 supabase: Client = create_client(supabase_url, supabase_key) if supabase_url and supabase_key else None
 
+# Storage bucket for uploads and results
+STORAGE_BUCKET = os.getenv('SUPABASE_BUCKET', 'diffusionlight-files')
+
+# Resumable (TUS) upload settings. Supabase requires 6MB chunks and
+# recommends resumable uploads for anything larger than that.
+TUS_CHUNK_SIZE = 6 * 1024 * 1024
+RESUMABLE_UPLOAD_THRESHOLD = TUS_CHUNK_SIZE
+TUS_MAX_RETRIES = 3
+
+# Paths per bulk-delete request
+STORAGE_DELETE_BATCH_SIZE = 1000
+
+# Transient storage errors are retried with capped, fully-jittered backoff
+STORAGE_MAX_RETRIES = 5
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+def _backoff_delay(attempt: int, base: float = 0.2, cap: float = 5.0) -> float:
+    """Full-jitter exponential backoff delay for a 0-based attempt"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+def _is_retryable(error: Exception) -> bool:
+    """Connection failures, timeouts, 429 and 5xx are worth retrying"""
+    if isinstance(error, (requests.exceptions.ConnectionError,
+                          requests.exceptions.Timeout,
+                          httpx.TransportError)):
+        return True
+
+    response = getattr(error, 'response', None)
+    if response is not None:
+        return response.status_code in RETRY_STATUSES
+
+    # storage3 raises StorageException({... 'statusCode': ...})
+    if error.args and isinstance(error.args[0], dict):
+        return error.args[0].get('statusCode') in RETRY_STATUSES
+
+    return False
+
+def with_retry(retries: int = STORAGE_MAX_RETRIES):
+    """Retry a storage call on transient errors with jittered backoff.
+
+    Only wrap idempotent operations: uploads use x-upsert on a path that is
+    unique per file, so a retry after a lost response rewrites the same
+    object instead of failing as a duplicate.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            for attempt in range(retries + 1):
+                try:
+                    return func(*args, **kwargs)
+                except Exception as e:
+                    if attempt == retries or not _is_retryable(e):
+                        raise
+                    time.sleep(_backoff_delay(attempt))
+        return wrapper
+    return decorator
+
+def _create_storage_session() -> requests.Session:
+    """Keep-alive session for Storage REST calls made outside the SDK"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+# Shared across SupabaseStorage instances so TCP/TLS connections stay warm
+storage_session = _create_storage_session()
+
+def get_supabase_client():
+    """Get the shared Supabase client (None if not configured)"""
+    return supabase
+
+@functools.lru_cache(maxsize=4096)
+def _public_url(bucket: str, file_path: str) -> str:
+    """Public URLs are a pure function of (bucket, path), so memoize them"""
+    return supabase.storage.from_(bucket).get_public_url(file_path)
+
+class SupabaseStorage:
+    """Wrapper around Supabase Storage for uploads and results"""
+
+    def __init__(self, bucket: str = STORAGE_BUCKET):
+        self.client = supabase
+        self.bucket = bucket
+
+    def _object_url(self, file_path: str) -> str:
+        return f"{supabase_url}/storage/v1/object/{self.bucket}/{file_path}"
+
+    def _auth_headers(self) -> dict:
+        return {
+            'Authorization': f'Bearer {supabase_key}',
+            'apikey': supabase_key
+        }
+
+    def _tus_headers(self) -> dict:
+        headers = self._auth_headers()
+        headers['Tus-Resumable'] = '1.0.0'
+        return headers
+
+    def upload_file(self, file_path, file_data, content_type=None, file_size=None):
+        """Upload bytes or a file-like object to storage.
+
+        File objects are streamed to the Storage REST endpoint so only one
+        socket buffer is resident at a time instead of the whole file. File
+        objects larger than RESUMABLE_UPLOAD_THRESHOLD go through the TUS
+        resumable endpoint so a dropped connection only costs one chunk.
+        """
+        if not self.client:
+            return None
+
+        if (file_size is not None and file_size > RESUMABLE_UPLOAD_THRESHOLD
+                and hasattr(file_data, 'read')):
+            return self.upload_file_resumable(file_path, file_data, file_size, content_type)
+
+        headers = self._auth_headers()
+        headers['Content-Type'] = content_type or 'application/octet-stream'
+        headers['x-upsert'] = 'true'
+        if file_size is not None:
+            headers['Content-Length'] = str(file_size)
+
+        try:
+            return self._post_object(file_path, file_data, headers)
+
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Error uploading file to storage: {e}")
+            return None
+
+    @with_retry()
+    def _post_object(self, file_path, file_data, headers):
+        # A failed attempt may have consumed part of a file-object body
+        if hasattr(file_data, 'seek'):
+            file_data.seek(0)
+
+        # requests sizes a body through fileno(), which rolls an in-memory
+        # spool over to disk; post the spool's BytesIO instead
+        if isinstance(file_data, tempfile.SpooledTemporaryFile) and not file_data._rolled:
+            file_data = file_data._file
+
+        response = storage_session.post(
+            self._object_url(file_path),
+            headers=headers,
+            data=file_data,
+            timeout=300
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def upload_file_resumable(self, file_path, file_obj, file_size, content_type=None):
+        """Upload a seekable file object with the TUS resumable protocol.
+
+        Chunks are sent in order (the TUS server only accepts a PATCH at the
+        current offset) and each one is retried independently with
+        exponential backoff, resuming from the offset the server reports.
+        """
+        if not self.client:
+            return None
+
+        metadata = {
+            'bucketName': self.bucket,
+            'objectName': file_path,
+            'contentType': content_type or 'application/octet-stream'
+        }
+        headers = self._tus_headers()
+        headers.update({
+            'Upload-Length': str(file_size),
+            'Upload-Metadata': ','.join(
+                f"{key} {base64.b64encode(value.encode('utf-8')).decode('ascii')}"
+                for key, value in metadata.items()
+            ),
+            'x-upsert': 'true'
+        })
+
+        try:
+            upload_url = self._create_resumable_upload(headers)
+
+            offset = 0
+            while offset < file_size:
+                file_obj.seek(offset)
+                chunk = file_obj.read(TUS_CHUNK_SIZE)
+                offset = self._upload_chunk(upload_url, chunk, offset)
+
+            return {'Key': f"{self.bucket}/{file_path}"}
+
+        except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+            print(f"Error uploading file to storage (resumable): {e}")
+            return None
+
+    @with_retry()
+    def _create_resumable_upload(self, headers) -> str:
+        """Create a TUS upload and return its upload URL"""
+        response = storage_session.post(
+            f"{supabase_url}/storage/v1/upload/resumable",
+            headers=headers,
+            timeout=30
+        )
+        response.raise_for_status()
+        return response.headers['Location']
+
+    def _upload_chunk(self, upload_url: str, chunk: bytes, offset: int) -> int:
+        """PATCH one chunk at ``offset`` and return the new server offset"""
+        headers = self._tus_headers()
+        headers['Content-Type'] = 'application/offset+octet-stream'
+
+        for attempt in range(TUS_MAX_RETRIES + 1):
+            try:
+                headers['Upload-Offset'] = str(offset)
+                response = storage_session.patch(upload_url, headers=headers, data=chunk, timeout=120)
+                response.raise_for_status()
+                return int(response.headers['Upload-Offset'])
+
+            except requests.exceptions.RequestException:
+                if attempt == TUS_MAX_RETRIES:
+                    raise
+                time.sleep(_backoff_delay(attempt, base=0.5, cap=8.0))
+
+                # Part of the chunk may have landed; resume from the server offset
+                head = storage_session.head(upload_url, headers=self._tus_headers(), timeout=30)
+                if head.ok and 'Upload-Offset' in head.headers:
+                    server_offset = int(head.headers['Upload-Offset'])
+                    if server_offset != offset:
+                        return server_offset
+
+    def download_file(self, file_path):
+        """Download file contents from storage"""
+        if not self.client:
+            return None
+
+        try:
+            return self._download(file_path)
+        except Exception as e:
+            print(f"Error downloading file from storage: {e}")
+            return None
+
+    def get_public_url(self, file_path):
+        """Get public URL for a stored file"""
+        if not self.client:
+            return None
+
+        return _public_url(self.bucket, file_path)
+
+    def delete_file(self, file_path):
+        """Delete a file from storage"""
+        if not self.client:
+            return False
+
+        try:
+            self._remove([file_path])
+            _public_url.cache_clear()
+            return True
+        except Exception as e:
+            print(f"Error deleting file from storage: {e}")
+            return False
+
+    def delete_files(self, file_paths):
+        """Delete many files, STORAGE_DELETE_BATCH_SIZE paths per request.
+
+        Returns the number of objects removed.
+        """
+        if not self.client or not file_paths:
+            return 0
+
+        deleted = 0
+        for start in range(0, len(file_paths), STORAGE_DELETE_BATCH_SIZE):
+            batch = file_paths[start:start + STORAGE_DELETE_BATCH_SIZE]
+            try:
+                removed = self._remove(batch)
+                deleted += len(removed) if isinstance(removed, list) else len(batch)
+            except Exception as e:
+                print(f"Error deleting files from storage: {e}")
+
+        _public_url.cache_clear()
+        return deleted
+
+    @with_retry()
+    def _download(self, file_path):
+        return self.client.storage.from_(self.bucket).download(file_path)
+
+    @with_retry()
+    def _remove(self, file_paths):
+        # Deleting by path is naturally idempotent
+        return self.client.storage.from_(self.bucket).remove(file_paths)
+
 def init_database(app):
-        """Initialize database with Flask app"""
+    """Initialize database with Flask app"""
 
     # Configure PostgreSQL for Supabase
-        database_url = os.getenv('DATABASE_URL')
-        if not database_url:
-                    # Fallback to SQLite for local development
-                    database_url =     
+    database_url = os.getenv('DATABASE_URL')
+    if not database_url:
+        # Fallback to SQLite for local development
+        database_url = 'sqlite:///diffusionlight.db'
+
     # Log database configuration
     if 'postgresql' in database_url:
         print(f"✅ Using PostgreSQL database: {database_url[:50]}...")
     else:
         print("⚠️ Using SQLite fallback database")
 
-        app.config['SQLALCHEMY_DATABASE_URI'] = database_url
-        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-            'pool_pre_ping': True,
-            'pool_recycle': 300,
-            'pool_timeout': 20,
-            'max_overflow': 0
-        }
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # On Supabase, point DATABASE_URL at the Supavisor transaction-mode
+    # pooler (port 6543) so app connections multiplex onto fewer backends.
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_pre_ping': True,
+        'pool_recycle': 300,
+        'pool_timeout': 20,
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 20)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 20))
+    }
 
     # Initialize SQLAlchemy with app
-        db.init_app(app)
+    db.init_app(app)
+
+    # Register models with the metadata before creating tables
+    import src.models.job  # noqa: F401
 
     # Create tables
-        with app.app_context():
-                    db.create_all(try:
-                db.create_all()
-                print("✅ Database tables created successfully")
-            except Exception as e:
-                print(f"⚠️ Database initialization warning: {e}")
-                # Continue without database for resilience
+    with app.app_context():
+        try:
+            db.create_all()
+            print("✅ Database tables created successfully")
+        except Exception as e:
+            print(f"⚠️ Database initialization warning: {e}")
+            # Continue without database for resilience
 
-        return db
+    return db
@@ -0,0 +1,33 @@
+import decimal
+import orjson
+from flask.json.provider import JSONProvider
+
+# Non-string dict keys are stringified like the stdlib encoder does
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+def _default(obj):
+    """Types orjson doesn't serialize natively"""
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson.
+
+    orjson serializes datetimes natively (ISO 8601) and produces bytes,
+    which ``response`` hands straight to the response object without a
+    str round-trip.
+    """
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_default, option=ORJSON_OPTIONS).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=_default, option=ORJSON_OPTIONS),
+            mimetype='application/json'
+        )
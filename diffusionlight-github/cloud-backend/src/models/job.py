@@ -1,6 +1,29 @@
+import os
+import time
+import uuid
+import hashlib
+import orjson
 from datetime import datetime
+from sqlalchemy.dialects.postgresql import JSONB
 from src.config.database import db
-import json
+
+# Native JSONB on PostgreSQL (decoded by the driver), plain JSON elsewhere
+JSONType = db.JSON().with_variant(JSONB(), 'postgresql')
+
+def generate_id() -> str:
+    """Generate a UUIDv7 string (48-bit millisecond timestamp + random bits).
+
+    Time-ordered ids append to the right edge of the primary-key btree
+    instead of landing on random pages like uuid4.
+    """
+    value = (time.time_ns() // 1_000_000) << 80 | int.from_bytes(os.urandom(10), 'big')
+    value = (value & ~(0xF << 76)) | (0x7 << 76)  # version 7
+    value = (value & ~(0x3 << 62)) | (0x2 << 62)  # RFC 4122 variant
+    return str(uuid.UUID(int=value))
+
+def configuration_hash(configuration) -> str:
+    """SHA-256 of a job configuration, independent of key order"""
+    return hashlib.sha256(orjson.dumps(configuration or {}, option=orjson.OPT_SORT_KEYS)).hexdigest()
 
 class Job(db.Model):
     __tablename__ = 'jobs'
@@ -18,19 +41,24 @@ class Job(db.Model):
     input_file_name = db.Column(db.String(255), nullable=False)
     
     # Configuration
-    configuration = db.Column(db.Text)  # JSON string
+    configuration = db.Column(JSONType)
+    
+    # Dedupe keys: SHA-256 of the input image and of the configuration
+    input_hash = db.Column(db.String(64))
+    config_hash = db.Column(db.String(64))
     
     # Timestamps
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     started_at = db.Column(db.DateTime)
     completed_at = db.Column(db.DateTime)
+    finalize_claimed_at = db.Column(db.DateTime)  # set by the finalizer collecting results
     
     # Processing info
     processing_time = db.Column(db.Float)  # in seconds
     error_message = db.Column(db.Text)
     
     # Results
-    result_files = db.Column(db.Text)  # JSON string with file paths
+    result_files = db.Column(JSONType)  # List of result file dicts
     
     # Relationships
     input_file = db.relationship('FileUpload', backref='jobs')
@@ -38,34 +66,7 @@ class Job(db.Model):
     def __init__(self, **kwargs):
         super(Job, self).__init__(**kwargs)
         if not self.id:
-            import uuid
-            self.id = str(uuid.uuid4())
-    
-    def set_configuration(self, config_dict):
-        """Set configuration as JSON string"""
-        self.configuration = json.dumps(config_dict) if config_dict else None
-    
-    def get_configuration(self):
-        """Get configuration as dictionary"""
-        if self.configuration:
-            try:
-                return json.loads(self.configuration)
-            except json.JSONDecodeError:
-                return {}
-        return {}
-    
-    def set_result_files(self, files_list):
-        """Set result files as JSON string"""
-        self.result_files = json.dumps(files_list) if files_list else None
-    
-    def get_result_files(self):
-        """Get result files as list"""
-        if self.result_files:
-            try:
-                return json.loads(self.result_files)
-            except json.JSONDecodeError:
-                return []
-        return []
+            self.id = generate_id()
     
     def to_dict(self):
         """Convert to dictionary for API responses"""
@@ -76,15 +77,36 @@ class Job(db.Model):
             'progress': self.progress,
             'input_file_id': self.input_file_id,
             'input_file_name': self.input_file_name,
-            'configuration': self.get_configuration(),
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'started_at': self.started_at.isoformat() if self.started_at else None,
-            'completed_at': self.completed_at.isoformat() if self.completed_at else None,
+            'configuration': self.configuration or {},
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'completed_at': self.completed_at,
             'processing_time': self.processing_time,
             'error_message': self.error_message,
-            'result_files': self.get_result_files()
+            'result_files': self.result_files or []
         }
 
+# Serves the job list's keyset pagination (ORDER BY created_at DESC, id DESC)
+db.Index('jobs_created_at_id_desc_idx', Job.created_at.desc(), Job.id.desc())
+
+# Webhook lookups by RunPod job id (one row per RunPod job; NULLs allowed)
+db.Index('jobs_external_job_id_idx', Job.external_job_id, unique=True)
+
+# Per-status counts and status-filtered job lists
+db.Index('jobs_status_created_at_idx', Job.status, Job.created_at.desc())
+
+# Finds a completed job with the same input image and configuration
+db.Index('jobs_dedupe_idx', Job.input_hash, Job.config_hash, Job.status)
+
+# Active jobs (the dashboard's common view) stay a small index
+ACTIVE_JOB_STATUSES = ('pending', 'processing')
+db.Index(
+    'jobs_active_idx',
+    Job.created_at.desc(),
+    postgresql_where=Job.status.in_(ACTIVE_JOB_STATUSES),
+    sqlite_where=Job.status.in_(ACTIVE_JOB_STATUSES)
+)
+
 class FileUpload(db.Model):
     __tablename__ = 'file_uploads'
     
@@ -113,8 +135,7 @@ class FileUpload(db.Model):
     def __init__(self, **kwargs):
         super(FileUpload, self).__init__(**kwargs)
         if not self.id:
-            import uuid
-            self.id = str(uuid.uuid4())
+            self.id = generate_id()
     
     def to_dict(self):
         """Convert to dictionary for API responses"""
@@ -130,6 +151,6 @@ class FileUpload(db.Model):
             'storage_path': self.storage_path,
             'public_url': self.public_url,
             'checksum': self.checksum,
-            'uploaded_at': self.uploaded_at.isoformat() if self.uploaded_at else None
+            'uploaded_at': self.uploaded_at
         }
 
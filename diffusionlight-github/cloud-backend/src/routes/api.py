@@ -1,76 +1,181 @@
 import os
+import base64
 import hashlib
+import tempfile
+import concurrent.futures
 from datetime import datetime
 from flask import Blueprint, request, jsonify, current_app
 from werkzeug.utils import secure_filename
-from PIL import Image
-import io
+from sqlalchemy import and_, or_
 
 from src.config.database import db, SupabaseStorage
-from src.models.job import Job, FileUpload
+from src.models.job import Job, FileUpload, ACTIVE_JOB_STATUSES, configuration_hash
 from src.services.runpod_service import get_runpod_service
-from src.workers.tasks import process_hdri_task
+from src.services.runpod_workflow import RunPodWorkflowManager
+from src.services.cache import ttl_cache, get_job_progress
 
 api_bp = Blueprint('api', __name__)
 
 # Initialize services
 storage = SupabaseStorage()
 runpod_service = get_runpod_service()
+workflow_manager = RunPodWorkflowManager()
+
+# Pool for CPU-bound upload work (hashlib releases the GIL on large buffers)
+_cpu_pool = concurrent.futures.ThreadPoolExecutor(
+    max_workers=os.cpu_count() or 4,
+    thread_name_prefix='upload-cpu'
+)
+
+# Pool for concurrent storage uploads in batch requests
+_upload_pool = concurrent.futures.ThreadPoolExecutor(
+    max_workers=8,
+    thread_name_prefix='upload-io'
+)
+
+# Upload settings
+ALLOWED_UPLOAD_EXTENSIONS = {'jpg', 'jpeg', 'png', 'tiff', 'tif'}
+MAX_UPLOAD_SIZE = 200 * 1024 * 1024  # 200MB
+MAX_BATCH_UPLOAD_FILES = 20
+UPLOAD_CHUNK_SIZE = 1024 * 1024      # 1MB read/hash granularity
+UPLOAD_SPOOL_SIZE = 4 * 1024 * 1024  # Spill to disk above 4MB
+
+# PIL plugins matching the allowed upload extensions
+UPLOAD_IMAGE_FORMATS = ('JPEG', 'PNG', 'TIFF')
+
+# Columns used by the job list view (skips the configuration/result JSON)
+JOB_SUMMARY_COLUMNS = (
+    Job.id,
+    Job.name,
+    Job.status,
+    Job.progress,
+    Job.input_file_name,
+    Job.created_at,
+    Job.started_at,
+    Job.completed_at,
+    Job.processing_time
+)
+
+def _encode_cursor(created_at, job_id):
+    """Opaque keyset cursor for the job list"""
+    raw = f"{created_at.isoformat()}|{job_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def _decode_cursor(cursor):
+    """Decode a cursor into (created_at, job_id); raises ValueError if invalid"""
+    raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+    created_at, job_id = raw.split('|', 1)
+    return datetime.fromisoformat(created_at), job_id
+
+def _spool_upload(stream, max_size):
+    """Copy an upload stream into a spooled temp file in one pass.
+
+    The SHA-256 checksum is updated chunk by chunk, and reading stops as soon
+    as ``max_size`` is exceeded. Returns ``(tmp, file_size, checksum)``; the
+    caller owns ``tmp`` and must close it.
+    """
+    tmp = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE)
+    checksum = hashlib.sha256()
+    file_size = 0
+
+    # Two reusable 1MB buffers: the pool hashes one chunk while this thread
+    # reads the next one into the other buffer. Each hash update still gets
+    # a large contiguous block (OpenSSL's SHA extensions) and no bytes
+    # object is allocated per chunk.
+    buffers = (bytearray(UPLOAD_CHUNK_SIZE), bytearray(UPLOAD_CHUNK_SIZE))
+    current = 0
+    pending = None
+
+    try:
+        while read := stream.readinto(buffers[current]):
+            file_size += read
+            if file_size > max_size:
+                break
+
+            chunk = memoryview(buffers[current])[:read]
+            tmp.write(chunk)
+
+            # At most one hash in flight, so updates stay in order and the
+            # buffer read into next is never the one being hashed
+            if pending:
+                pending.result()
+            pending = _cpu_pool.submit(checksum.update, chunk)
+            current ^= 1
+    finally:
+        if pending:
+            pending.result()
+
+    tmp.seek(0)
+    return tmp, file_size, checksum.hexdigest()
+
+@ttl_cache(10)
+def _service_availability():
+    """RunPod/storage availability, cached so health probes stay O(1)"""
+    return {
+        'runpod': runpod_service.is_available(),
+        'storage': storage.client is not None
+    }
 
 @api_bp.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
+    services = _service_availability()
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.utcnow().isoformat(),
         'services': {
             'database': 'connected',
-            'storage': 'available' if storage.client else 'unavailable',
-            'runpod': 'available' if runpod_service.is_available() else 'mock'
+            'storage': 'available' if services['storage'] else 'unavailable',
+            'runpod': 'available' if services['runpod'] else 'mock'
         }
     })
 
-@api_bp.route('/files/upload', methods=['POST'])
-def upload_file():
-    """Upload file endpoint with Supabase Storage"""
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file provided'}), 400
+def _upload_too_large():
+    """Reject oversized bodies from Content-Length before reading them"""
+    content_length = request.content_length
+    return content_length is not None and content_length > MAX_UPLOAD_SIZE
+
+def _store_upload(file):
+    """Validate, hash and upload one file to Supabase Storage.
+
+    Returns ``(file_upload, error, status)``. On success ``file_upload`` is a
+    FileUpload that still needs to be added to the session. Doesn't touch
+    Flask globals, so it can run on a worker thread.
+    """
+    from PIL import Image
     
-    file = request.files['file']
     if file.filename == '':
-        return jsonify({'error': 'No file selected'}), 400
+        return None, 'No file selected', 400
     
     # Validate file type
-    allowed_extensions = {'jpg', 'jpeg', 'png', 'tiff', 'tif'}
     file_ext = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else ''
     
-    if file_ext not in allowed_extensions:
-        return jsonify({'error': 'Invalid file type. Supported: JPG, PNG, TIFF'}), 400
+    if file_ext not in ALLOWED_UPLOAD_EXTENSIONS:
+        return None, 'Invalid file type. Supported: JPG, PNG, TIFF', 400
     
+    tmp = None
     try:
-        # Read file data
-        file_data = file.read()
-        file_size = len(file_data)
+        # Stream file data to a spooled temp file
+        tmp, file_size, checksum = _spool_upload(file.stream, MAX_UPLOAD_SIZE)
         
         # Validate file size (200MB max)
-        max_size = 200 * 1024 * 1024
-        if file_size > max_size:
-            return jsonify({'error': 'File too large. Maximum size: 200MB'}), 400
+        if file_size > MAX_UPLOAD_SIZE:
+            return None, 'File too large. Maximum size: 200MB', 413
         
-        # Calculate checksum
-        checksum = hashlib.sha256(file_data).hexdigest()
-        
-        # Get image metadata
+        # Get image metadata from the header only. Restricting the plugins
+        # skips probing every registered format, and nothing touches the
+        # pixel data so no decode buffers are allocated.
         image_metadata = {}
         try:
-            image = Image.open(io.BytesIO(file_data))
-            image_metadata = {
-                'width': image.width,
-                'height': image.height,
-                'format': image.format
-            }
+            with Image.open(tmp, formats=UPLOAD_IMAGE_FORMATS) as image:
+                image_metadata = {
+                    'width': image.width,
+                    'height': image.height,
+                    'format': image.format
+                }
         except Exception as e:
             print(f"Error reading image metadata: {e}")
+        tmp.seek(0)
         
         # Create file record
         file_upload = FileUpload(
@@ -88,28 +193,95 @@ def upload_file():
         # Upload to Supabase Storage
         upload_result = storage.upload_file(
             file_path=storage_path,
-            file_data=file_data,
-            content_type=file.content_type
+            file_data=tmp,
+            content_type=file.content_type,
+            file_size=file_size
         )
         
-        if upload_result:
-            # Get public URL
-            public_url = storage.get_public_url(storage_path)
-            
-            file_upload.storage_path = storage_path
-            file_upload.public_url = public_url
-            
-            # Save to database
-            db.session.add(file_upload)
-            db.session.commit()
-            
-            return jsonify({
-                'success': True,
-                'file': file_upload.to_dict()
-            })
-        else:
-            return jsonify({'error': 'Failed to upload file to storage'}), 500
-            
+        if not upload_result:
+            return None, 'Failed to upload file to storage', 500
+        
+        file_upload.storage_path = storage_path
+        file_upload.public_url = storage.get_public_url(storage_path)
+        
+        return file_upload, None, None
+        
+    except Exception as e:
+        return None, f'Upload failed: {str(e)}', 500
+    finally:
+        if tmp is not None:
+            tmp.close()
+
+@api_bp.route('/files/upload', methods=['POST'])
+def upload_file():
+    """Upload file endpoint with Supabase Storage"""
+    if _upload_too_large():
+        return jsonify({'error': 'File too large. Maximum size: 200MB'}), 413
+    
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file provided'}), 400
+    
+    file_upload, error, status = _store_upload(request.files['file'])
+    if error:
+        return jsonify({'error': error}), status
+    
+    try:
+        # Save to database
+        db.session.add(file_upload)
+        # Serialize before committing; commit expires the loaded attributes
+        db.session.flush()
+        file_data = file_upload.to_dict()
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'file': file_data
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Upload failed: {str(e)}'}), 500
+
+@api_bp.route('/files/upload-batch', methods=['POST'])
+def upload_files_batch():
+    """Upload several files in one request.
+
+    Files are processed and sent to storage concurrently, and all records
+    are saved in a single transaction. Files that fail are reported in
+    ``errors`` without failing the rest of the batch.
+    """
+    if _upload_too_large():
+        return jsonify({'error': 'Upload too large. Maximum size: 200MB'}), 413
+    
+    files = request.files.getlist('file')
+    if not files:
+        return jsonify({'error': 'No file provided'}), 400
+    
+    if len(files) > MAX_BATCH_UPLOAD_FILES:
+        return jsonify({'error': f'Too many files. Maximum per batch: {MAX_BATCH_UPLOAD_FILES}'}), 400
+    
+    results = list(_upload_pool.map(_store_upload, files))
+    
+    uploads = [file_upload for file_upload, _, _ in results if file_upload]
+    errors = [
+        {'filename': file.filename, 'error': error}
+        for file, (_, error, _) in zip(files, results) if error
+    ]
+    
+    try:
+        # Save all records in one transaction
+        db.session.add_all(uploads)
+        # Serialize before committing; commit expires the loaded attributes
+        db.session.flush()
+        files = [file_upload.to_dict() for file_upload in uploads]
+        db.session.commit()
+        
+        return jsonify({
+            'success': not errors,
+            'files': files,
+            'errors': errors
+        })
+        
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': f'Upload failed: {str(e)}'}), 500
@@ -117,64 +289,52 @@ def upload_file():
 @api_bp.route('/jobs', methods=['POST'])
 def create_job():
     """Create new processing job"""
+    from src.workers.tasks import process_hdri_task
+    
     data = request.get_json()
     
     if not data or 'file_id' not in data:
         return jsonify({'error': 'file_id is required'}), 400
     
     # Get file upload record
-    file_upload = FileUpload.query.get(data['file_id'])
+    file_upload = db.session.get(FileUpload, data['file_id'])
     if not file_upload:
         return jsonify({'error': 'File not found'}), 404
     
+    # Store, process and hash the configuration with defaults applied, so
+    # jobs with equal hashes really run the same settings
+    try:
+        configuration = workflow_manager.validate_configuration(data.get('configuration', {}))
+    except (AttributeError, TypeError, ValueError):
+        return jsonify({'error': 'Invalid configuration'}), 400
+    
     try:
         # Create job record
         job = Job(
             name=data.get('name', f"HDRI - {file_upload.original_filename}"),
             input_file_id=file_upload.id,
             input_file_name=file_upload.original_filename,
-            status='pending'
+            status='pending',
+            configuration=configuration,
+            input_hash=file_upload.checksum,
+            config_hash=configuration_hash(configuration)
         )
         
-        # Set configuration
-        configuration = data.get('configuration', {})
-        job.set_configuration(configuration)
-        
         # Save to database
         db.session.add(job)
+        # Serialize before committing; commit expires the loaded attributes
+        db.session.flush()
+        job_data = job.to_dict()
         db.session.commit()
         
-        # Submit to processing queue
-        if runpod_service.is_available():
-            # Use RunPod for processing
-            runpod_input = runpod_service.prepare_diffusionlight_input(
-                image_url=file_upload.public_url,
-                configuration=configuration
-            )
-            
-            runpod_job_id = runpod_service.submit_job(runpod_input)
-            
-            if runpod_job_id:
-                # Start monitoring task
-                process_hdri_task.delay(job.id, runpod_job_id)
-                job.status = 'processing'
-                job.started_at = datetime.utcnow()
-                db.session.commit()
-            else:
-                job.status = 'failed'
-                job.error_message = 'Failed to submit job to RunPod'
-                db.session.commit()
-        else:
-            # Use local/mock processing
-            process_hdri_task.delay(job.id)
-            job.status = 'processing'
-            job.started_at = datetime.utcnow()
-            db.session.commit()
+        # Queue for processing; the worker submits to RunPod so the
+        # request doesn't wait on the RunPod API
+        process_hdri_task.delay(job_data['id'])
         
         return jsonify({
             'success': True,
-            'job_id': job.id,
-            'job': job.to_dict()
+            'job_id': job_data['id'],
+            'job': job_data
         })
         
     except Exception as e:
@@ -183,27 +343,70 @@ def create_job():
 
 @api_bp.route('/jobs/<job_id>', methods=['GET'])
 def get_job(job_id):
-    """Get job details"""
-    job = Job.query.get(job_id)
+    """Get job details.
+    
+    Sent with an ETag and ``Cache-Control: no-cache``, so a polling browser
+    revalidates with If-None-Match and gets an empty 304 until the job's
+    status or progress changes.
+    """
+    job = db.session.get(Job, job_id)
     if not job:
         return jsonify({'error': 'Job not found'}), 404
     
-    return jsonify(job.to_dict())
+    data = job.to_dict()
+    
+    # Progress ticks land in Redis first and reach the row every few seconds
+    if job.status in ACTIVE_JOB_STATUSES:
+        progress = get_job_progress(job.id)
+        if progress is not None:
+            data['progress'] = progress
+    
+    response = jsonify(data)
+    response.add_etag()
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 @api_bp.route('/jobs', methods=['GET'])
 def list_jobs():
-    """List jobs with pagination"""
+    """List jobs with keyset (cursor) pagination, optionally by status"""
     limit = min(int(request.args.get('limit', 50)), 100)
-    offset = int(request.args.get('offset', 0))
+    cursor = request.args.get('cursor')
+    statuses = [status for status in request.args.get('status', '').split(',') if status]
+    
+    query = db.session.query(*JOB_SUMMARY_COLUMNS)
+    
+    # e.g. ?status=pending,processing for active jobs
+    if statuses:
+        query = query.filter(Job.status.in_(statuses))
+    
+    if cursor:
+        try:
+            cursor_created_at, cursor_id = _decode_cursor(cursor)
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        
+        query = query.filter(or_(
+            Job.created_at < cursor_created_at,
+            and_(Job.created_at == cursor_created_at, Job.id < cursor_id)
+        ))
+    
+    # Fetch one extra row to know whether there is a next page
+    rows = query.order_by(Job.created_at.desc(), Job.id.desc()).limit(limit + 1).all()
     
-    jobs = Job.query.order_by(Job.created_at.desc()).offset(offset).limit(limit).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1].created_at, rows[-1].id)
     
-    return jsonify([job.to_dict() for job in jobs])
+    return jsonify({
+        'jobs': [row._asdict() for row in rows],
+        'next_cursor': next_cursor
+    })
 
 @api_bp.route('/jobs/<job_id>/cancel', methods=['POST'])
 def cancel_job(job_id):
     """Cancel a job"""
-    job = Job.query.get(job_id)
+    job = db.session.get(Job, job_id)
     if not job:
         return jsonify({'error': 'Job not found'}), 404
     
@@ -218,11 +421,14 @@ def cancel_job(job_id):
         
         job.status = 'cancelled'
         job.completed_at = datetime.utcnow()
+        # Serialize before committing; commit expires the loaded attributes
+        db.session.flush()
+        job_data = job.to_dict()
         db.session.commit()
         
         return jsonify({
             'success': True,
-            'job': job.to_dict()
+            'job': job_data
         })
         
     except Exception as e:
@@ -232,14 +438,14 @@ def cancel_job(job_id):
 @api_bp.route('/jobs/<job_id>/results', methods=['GET'])
 def get_job_results(job_id):
     """Get job results"""
-    job = Job.query.get(job_id)
+    job = db.session.get(Job, job_id)
     if not job:
         return jsonify({'error': 'Job not found'}), 404
     
     if job.status != 'completed':
         return jsonify({'error': 'Job not completed'}), 400
     
-    result_files = job.get_result_files()
+    result_files = job.result_files or []
     
     return jsonify({
         'job_id': job.id,
@@ -247,50 +453,62 @@ def get_job_results(job_id):
         'files': result_files,
         'metadata': {
             'processing_time': job.processing_time,
-            'configuration': job.get_configuration(),
-            'completed_at': job.completed_at.isoformat() if job.completed_at else None
+            'configuration': job.configuration or {},
+            'completed_at': job.completed_at
         }
     })
 
+@ttl_cache(10)
+def _collect_statistics():
+    """Job and file statistics in two aggregate queries (cached for 10s)"""
+    completed = Job.status == 'completed'
+    
+    # Job statistics in a single pass over jobs (COUNT/AVG ... FILTER)
+    total_jobs, completed_jobs, processing_jobs, failed_jobs, avg_processing_time = db.session.query(
+        db.func.count(Job.id),
+        db.func.count(Job.id).filter(completed),
+        db.func.count(Job.id).filter(Job.status == 'processing'),
+        db.func.count(Job.id).filter(Job.status == 'failed'),
+        db.func.avg(Job.processing_time).filter(completed, Job.processing_time.isnot(None))
+    ).one()
+    
+    # File statistics
+    total_files, total_storage_size = db.session.query(
+        db.func.count(FileUpload.id),
+        db.func.sum(FileUpload.file_size)
+    ).one()
+    
+    # Calculate success rate
+    success_rate = (completed_jobs / total_jobs * 100) if total_jobs > 0 else 0
+    
+    return {
+        'jobs': {
+            'total': total_jobs,
+            'completed': completed_jobs,
+            'processing': processing_jobs,
+            'failed': failed_jobs,
+            'success_rate': round(success_rate, 1),
+            'avg_processing_time': round(float(avg_processing_time or 0), 1)
+        },
+        'files': {
+            'total': total_files,
+            'total_size_mb': round(float(total_storage_size or 0) / 1024 / 1024, 2)
+        }
+    }
+
 @api_bp.route('/statistics', methods=['GET'])
 def get_statistics():
     """Get system statistics"""
     try:
-        # Job statistics
-        total_jobs = Job.query.count()
-        completed_jobs = Job.query.filter_by(status='completed').count()
-        processing_jobs = Job.query.filter_by(status='processing').count()
-        failed_jobs = Job.query.filter_by(status='failed').count()
-        
-        # Calculate success rate
-        success_rate = (completed_jobs / total_jobs * 100) if total_jobs > 0 else 0
-        
-        # Average processing time
-        avg_processing_time = db.session.query(db.func.avg(Job.processing_time)).filter(
-            Job.status == 'completed',
-            Job.processing_time.isnot(None)
-        ).scalar() or 0
-        
-        # File statistics
-        total_files = FileUpload.query.count()
-        total_storage_size = db.session.query(db.func.sum(FileUpload.file_size)).scalar() or 0
+        statistics = _collect_statistics()
+        services = _service_availability()
         
         return jsonify({
-            'jobs': {
-                'total': total_jobs,
-                'completed': completed_jobs,
-                'processing': processing_jobs,
-                'failed': failed_jobs,
-                'success_rate': round(success_rate, 1),
-                'avg_processing_time': round(avg_processing_time, 1)
-            },
-            'files': {
-                'total': total_files,
-                'total_size_mb': round(total_storage_size / 1024 / 1024, 2)
-            },
+            'jobs': statistics['jobs'],
+            'files': statistics['files'],
             'services': {
-                'runpod_available': runpod_service.is_available(),
-                'storage_available': storage.client is not None
+                'runpod_available': services['runpod'],
+                'storage_available': services['storage']
             }
         })
         
@@ -300,7 +518,7 @@ def get_statistics():
 @api_bp.route('/files/<file_id>/download', methods=['GET'])
 def download_file(file_id):
     """Download file from storage"""
-    file_upload = FileUpload.query.get(file_id)
+    file_upload = db.session.get(FileUpload, file_id)
     if not file_upload:
         return jsonify({'error': 'File not found'}), 404
     
@@ -1,156 +1,328 @@
+import io
 import os
 import hmac
-import hashlib
+import zlib
+import orjson
 from datetime import datetime
 from flask import Blueprint, request, jsonify, current_app
-from src.config.database import db
-from src.models.job import Job
+from src.services.runpod_service import verify_callback_token, CALLBACKS_ENABLED
 
 webhooks_bp = Blueprint('webhooks', __name__)
 
+# Webhook secret key bytes, encoded once at import
+WEBHOOK_SECRET_KEY = os.getenv('WEBHOOK_SECRET', 'default-secret').encode('utf-8')
+
+# Largest webhook body accepted (as sent), per endpoint
+MAX_WEBHOOK_SIZE = 256 * 1024  # 256KB
+MAX_WEBHOOK_BATCH_SIZE = 4 * 1024 * 1024  # 4MB
+
+# Chunk size when counting a webhook body that has no Content-Length
+WEBHOOK_READ_CHUNK_SIZE = 64 * 1024
+
+# Cap on a gzip-encoded webhook body after decompression
+MAX_DECOMPRESSED_SIZE = 16 * 1024 * 1024  # 16MB
+
+# Upper bound on events accepted by one /runpod/batch request
+MAX_BATCH_EVENTS = 500
+
+# Keyed HMAC with the ipad/opad already derived; copied per request
+_HMAC_TEMPLATE = hmac.new(WEBHOOK_SECRET_KEY, digestmod='sha256')
+
 def verify_webhook_signature(payload: bytes, signature: str) -> bool:
-    """Verify webhook signature for security"""
-    secret = os.getenv('WEBHOOK_SECRET', 'default-secret')
-    expected_signature = hmac.new(
-        secret.encode('utf-8'),
-        payload,
-        hashlib.sha256
-    ).hexdigest()
+    """Verify a ``sha256=<hex>`` webhook signature against the raw digest"""
+    if not signature.startswith('sha256='):
+        return False
+    
+    try:
+        provided = bytes.fromhex(signature[7:])
+    except ValueError:
+        return False
+    
+    mac = _HMAC_TEMPLATE.copy()
+    mac.update(payload)
+    
+    return hmac.compare_digest(mac.digest(), provided)
+
+def _webhook_size_limit() -> int:
+    if request.endpoint == 'webhooks.runpod_webhook_batch':
+        return MAX_WEBHOOK_BATCH_SIZE
+    return MAX_WEBHOOK_SIZE
+
+@webhooks_bp.before_request
+def limit_webhook_size():
+    """Reject oversized webhook bodies before any of the body is read"""
+    if request.content_length is not None and request.content_length > _webhook_size_limit():
+        return jsonify({'error': 'Webhook body too large'}), 413
+
+def _read_capped(stream, limit: int, length: int = None) -> bytes:
+    """Read ``length`` bytes (or to EOF) in chunks, raising OverflowError past ``limit``"""
+    chunks = []
+    size = 0
+    
+    while length is None or size < length:
+        want = WEBHOOK_READ_CHUNK_SIZE if length is None else min(WEBHOOK_READ_CHUNK_SIZE, length - size)
+        chunk = stream.read(want)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > limit:
+            raise OverflowError('Webhook body too large')
+        chunks.append(chunk)
+    
+    return b''.join(chunks)
+
+def read_webhook_body() -> bytes:
+    """Read the request body, raising OverflowError past the size limit.
+    
+    Covers chunked requests, which carry no Content-Length for
+    limit_webhook_size to check.
+    """
+    return _read_capped(request.stream, _webhook_size_limit())
+
+def _receive_webhook_body():
+    """Return (payload, error, status) for the current webhook request.
+    
+    Behind WebhookSignatureMiddleware the body was already read and its
+    signature checked; otherwise both happen here.
+    """
+    payload = request.environ.get('webhook.body')
+    if payload is None:
+        try:
+            payload = read_webhook_body()
+        except OverflowError:
+            return None, 'Webhook body too large', 413
+    
+    # Verify signature if provided
+    signature = request.headers.get('X-Signature')
+    if signature and not request.environ.get('webhook.verified'):
+        if not verify_webhook_signature(payload, signature):
+            return None, 'Invalid signature', 401
+    
+    return payload, None, None
+
+class WebhookSignatureMiddleware:
+    """WSGI filter that checks RunPod webhook signatures before Flask runs.
+    
+    Oversized or badly signed POSTs to the RunPod endpoints are answered
+    here, skipping Flask's request setup and routing. Accepted bodies are
+    left in ``environ['webhook.body']`` so the view doesn't read them again.
+    """
+    
+    def __init__(self, wsgi_app, prefix: str = '/webhooks'):
+        self.wsgi_app = wsgi_app
+        self.limits = {
+            f'{prefix}/runpod': MAX_WEBHOOK_SIZE,
+            f'{prefix}/runpod/batch': MAX_WEBHOOK_BATCH_SIZE
+        }
+    
+    def __call__(self, environ, start_response):
+        limit = self.limits.get(environ.get('PATH_INFO'))
+        if limit is None or environ.get('REQUEST_METHOD') != 'POST':
+            return self.wsgi_app(environ, start_response)
+        
+        try:
+            body = self._read_body(environ, limit)
+        except OverflowError:
+            return self._error(start_response, '413 Request Entity Too Large', 'Webhook body too large')
+        except ValueError:
+            return self._error(start_response, '400 Bad Request', 'Invalid Content-Length')
+        
+        signature = environ.get('HTTP_X_SIGNATURE')
+        if signature:
+            if not verify_webhook_signature(body, signature):
+                return self._error(start_response, '401 Unauthorized', 'Invalid signature')
+            environ['webhook.verified'] = True
+        
+        environ['webhook.body'] = body
+        environ['wsgi.input'] = io.BytesIO(body)
+        environ['CONTENT_LENGTH'] = str(len(body))
+        return self.wsgi_app(environ, start_response)
+    
+    def _read_body(self, environ, limit: int) -> bytes:
+        stream = environ['wsgi.input']
+        content_length = environ.get('CONTENT_LENGTH')
+        
+        if content_length:
+            length = int(content_length)
+            if length > limit:
+                raise OverflowError('Webhook body too large')
+            return _read_capped(stream, limit, length)
+        
+        # Chunked bodies are only readable to EOF when the server terminates them
+        if environ.get('wsgi.input_terminated'):
+            return _read_capped(stream, limit)
+        
+        return b''
+    
+    def _error(self, start_response, status: str, message: str):
+        body = orjson.dumps({'error': message})
+        start_response(status, [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body)))
+        ])
+        return [body]
+
+def decode_webhook_body(payload: bytes) -> bytes:
+    """Undo ``Content-Encoding: gzip`` on a webhook body.
+    
+    Decompression stops at MAX_DECOMPRESSED_SIZE so a small compressed body
+    can't expand without bound; OverflowError is raised past the cap.
+    """
+    if request.headers.get('Content-Encoding', '').lower() != 'gzip':
+        return payload
     
-    return hmac.compare_digest(f"sha256={expected_signature}", signature)
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    body = decompressor.decompress(payload, MAX_DECOMPRESSED_SIZE)
+    if decompressor.unconsumed_tail:
+        raise OverflowError('Decompressed webhook body too large')
+    return body
 
 @webhooks_bp.route('/runpod', methods=['POST'])
 def runpod_webhook():
-    """Handle RunPod webhook notifications"""
+    """Handle RunPod webhook notifications.
+    
+    Only verifies and validates the payload here; the job update runs in the
+    process_runpod_webhook Celery task so the request never waits on the DB.
+    """
+    # Import here to keep Celery off the app import path
+    from src.workers.tasks import process_runpod_webhook
+    
     try:
-        # Verify signature if provided
-        signature = request.headers.get('X-Signature')
-        if signature:
-            if not verify_webhook_signature(request.data, signature):
-                return jsonify({'error': 'Invalid signature'}), 401
+        # Read the body once for both the signature check and the parse
+        payload, error, code = _receive_webhook_body()
+        if error:
+            return jsonify({'error': error}), code
         
-        data = request.get_json()
-        if not data:
+        # The signature covers the body as sent, so check it before inflating
+        try:
+            payload = decode_webhook_body(payload)
+            data = orjson.loads(payload) if payload else None
+        except OverflowError:
+            return jsonify({'error': 'Webhook body too large'}), 413
+        except (zlib.error, orjson.JSONDecodeError):
+            return jsonify({'error': 'Invalid JSON'}), 400
+        
+        if not data or not isinstance(data, dict):
             return jsonify({'error': 'No data provided'}), 400
         
         # Extract job information
         runpod_job_id = data.get('id')
         status = data.get('status')
-        output = data.get('output', {})
-        error = data.get('error')
         
         if not runpod_job_id:
             return jsonify({'error': 'No job ID provided'}), 400
         
-        # Find corresponding job in database
-        # Note: We need to store RunPod job ID in our Job model
-        job = Job.query.filter_by(external_job_id=runpod_job_id).first()
-        
-        if not job:
-            current_app.logger.warning(f"Received webhook for unknown job: {runpod_job_id}")
-            return jsonify({'message': 'Job not found, but webhook received'}), 200
+        process_runpod_webhook.delay(
+            runpod_job_id,
+            status,
+            data.get('output') or {},
+            data.get('error'),
+            data.get('progress')
+        )
         
-        # Update job based on RunPod status
-        if status == 'COMPLETED':
-            handle_completed_job(job, output)
-        elif status == 'FAILED':
-            handle_failed_job(job, error)
-        elif status == 'IN_PROGRESS':
-            handle_progress_update(job, data)
-        elif status == 'CANCELLED':
-            handle_cancelled_job(job)
-        
-        db.session.commit()
-        
-        return jsonify({'message': 'Webhook processed successfully'}), 200
+        return jsonify({'message': 'Webhook accepted'}), 202
         
     except Exception as e:
         current_app.logger.error(f"Webhook processing error: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
-def handle_completed_job(job: Job, output: dict):
-    """Handle completed job webhook"""
-    job.status = 'completed'
-    job.completed_at = datetime.utcnow()
-    job.progress = 100
+@webhooks_bp.route('/runpod/batch', methods=['POST'])
+def runpod_webhook_batch():
+    """Handle a batch of RunPod webhook events.
     
-    if job.started_at:
-        job.processing_time = (job.completed_at - job.started_at).total_seconds()
+    The body is a JSON array of webhook payloads or one payload per line
+    (JSONL). The signature covers the whole body and is checked once; the
+    events are applied by a single Celery task in one transaction.
+    """
+    # Import here to keep Celery off the app import path
+    from src.workers.tasks import process_runpod_webhook_batch
     
-    # Process output files
-    result_files = []
-    
-    # Extract result URLs from output
-    if 'images' in output:
-        for i, image_info in enumerate(output['images']):
-            if isinstance(image_info, dict):
-                url = image_info.get('url')
-                filename = image_info.get('filename', f'result_{i}.hdr')
+    try:
+        payload, error, code = _receive_webhook_body()
+        if error:
+            return jsonify({'error': error}), code
+        
+        try:
+            payload = decode_webhook_body(payload)
+            if payload.lstrip().startswith(b'['):
+                items = orjson.loads(payload)
             else:
-                url = image_info
-                filename = f'result_{i}.hdr'
+                items = [orjson.loads(line) for line in payload.splitlines() if line.strip()]
+        except OverflowError:
+            return jsonify({'error': 'Webhook body too large'}), 413
+        except (zlib.error, orjson.JSONDecodeError):
+            return jsonify({'error': 'Invalid JSON'}), 400
+        
+        if not items:
+            return jsonify({'error': 'No events provided'}), 400
+        
+        if len(items) > MAX_BATCH_EVENTS:
+            return jsonify({'error': f'Too many events. Maximum: {MAX_BATCH_EVENTS}'}), 413
+        
+        events = []
+        for i, item in enumerate(items):
+            if not isinstance(item, dict) or not item.get('id'):
+                return jsonify({'error': f'Event {i} has no job ID'}), 400
             
-            if url:
-                result_files.append({
-                    'filename': filename,
-                    'download_url': url,
-                    'type': 'result',
-                    'format': filename.split('.')[-1] if '.' in filename else 'hdr'
-                })
-    
-    # Extract metadata
-    metadata = output.get('metadata', {})
-    if metadata:
-        result_files.append({
-            'filename': 'metadata.json',
-            'content': metadata,
-            'type': 'metadata',
-            'format': 'json'
-        })
-    
-    job.set_result_files(result_files)
-    
-    current_app.logger.info(f"Job {job.id} completed successfully")
+            events.append({
+                'id': item['id'],
+                'status': item.get('status'),
+                'output': item.get('output') or {},
+                'error': item.get('error'),
+                'progress': item.get('progress')
+            })
+        
+        process_runpod_webhook_batch.delay(events)
+        
+        return jsonify({'message': 'Webhooks accepted', 'count': len(events)}), 202
+        
+    except Exception as e:
+        current_app.logger.error(f"Webhook batch processing error: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
 
-def handle_failed_job(job: Job, error: str):
-    """Handle failed job webhook"""
-    job.status = 'failed'
-    job.completed_at = datetime.utcnow()
-    job.error_message = error or 'Job failed on RunPod'
+@webhooks_bp.route('/runpod/callback/<job_id>', methods=['POST'])
+def runpod_callback(job_id):
+    """Handle RunPod's completion callback for one job.
     
-    if job.started_at:
-        job.processing_time = (job.completed_at - job.started_at).total_seconds()
+    The URL was handed to RunPod at submission with an HMAC token for the
+    job; the posted status is passed straight to finalize_hdri_task.
+    """
+    # Import here to keep Celery off the app import path
+    from src.workers.tasks import finalize_hdri_task
     
-    current_app.logger.error(f"Job {job.id} failed: {error}")
-
-def handle_progress_update(job: Job, data: dict):
-    """Handle progress update webhook"""
-    if job.status == 'pending':
-        job.status = 'processing'
-        job.started_at = datetime.utcnow()
+    if not CALLBACKS_ENABLED:
+        return jsonify({'error': 'Callbacks not configured'}), 404
     
-    # Extract progress information
-    progress_info = data.get('progress', {})
+    if not verify_callback_token(job_id, request.args.get('token')):
+        return jsonify({'error': 'Invalid token'}), 401
     
-    if isinstance(progress_info, dict):
-        progress = progress_info.get('percentage', job.progress)
-        current_step = progress_info.get('current_step', '')
-        total_steps = progress_info.get('total_steps', 0)
+    try:
+        payload, error, code = _receive_webhook_body()
+        if error:
+            return jsonify({'error': error}), code
         
-        if isinstance(progress, (int, float)):
-            job.progress = min(max(int(progress), 0), 99)  # Keep between 0-99 until completion
-    
-    current_app.logger.info(f"Job {job.id} progress: {job.progress}%")
-
-def handle_cancelled_job(job: Job):
-    """Handle cancelled job webhook"""
-    job.status = 'cancelled'
-    job.completed_at = datetime.utcnow()
-    
-    if job.started_at:
-        job.processing_time = (job.completed_at - job.started_at).total_seconds()
-    
-    current_app.logger.info(f"Job {job.id} was cancelled")
+        try:
+            payload = decode_webhook_body(payload)
+            data = orjson.loads(payload) if payload else None
+        except OverflowError:
+            return jsonify({'error': 'Webhook body too large'}), 413
+        except (zlib.error, orjson.JSONDecodeError):
+            return jsonify({'error': 'Invalid JSON'}), 400
+        
+        if not data or not isinstance(data, dict):
+            return jsonify({'error': 'No data provided'}), 400
+        
+        finalize_hdri_task.delay(job_id, {
+            'status': data.get('status'),
+            'output': data.get('output') or {},
+            'error': data.get('error')
+        })
+        
+        return jsonify({'message': 'Callback accepted'}), 202
+        
+    except Exception as e:
+        current_app.logger.error(f"RunPod callback error: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
 
 @webhooks_bp.route('/test', methods=['POST'])
 def test_webhook():
@@ -0,0 +1,91 @@
+import os
+import time
+import logging
+import threading
+import functools
+import redis
+import orjson
+
+# Short-lived job state lives on the Celery broker's Redis
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+# Latest progress percentage per job, buffered between DB flushes
+JOB_PROGRESS_KEY = 'job:{}:progress'
+JOB_PROGRESS_PATTERN = 'job:*:progress'
+JOB_PROGRESS_TTL = 60
+
+# RunPod status responses, shared by every worker watching the same job
+RUNPOD_STATUS_KEY = 'runpod:status:{}'
+RUNPOD_STATUS_TTL = 2
+
+logger = logging.getLogger(__name__)
+
+_redis_client = None
+
+def get_redis_client():
+    """Get the shared Redis client (connections are opened lazily)"""
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(REDIS_URL)
+    return _redis_client
+
+def set_job_progress(job_id: str, progress: int) -> bool:
+    """Buffer a job's latest progress in Redis; False if Redis is down"""
+    try:
+        get_redis_client().set(JOB_PROGRESS_KEY.format(job_id), progress, ex=JOB_PROGRESS_TTL)
+        return True
+    except redis.RedisError as e:
+        logger.warning("Error buffering progress for job %s: %s", job_id, e)
+        return False
+
+def get_job_progress(job_id: str):
+    """Buffered progress for a job not yet flushed to the DB, or None"""
+    try:
+        value = get_redis_client().get(JOB_PROGRESS_KEY.format(job_id))
+    except redis.RedisError:
+        return None
+    return int(value) if value is not None else None
+
+def cache_get_json(key: str):
+    """Read a JSON value from Redis; None on a miss or if Redis is down"""
+    try:
+        value = get_redis_client().get(key)
+    except redis.RedisError:
+        return None
+    return orjson.loads(value) if value is not None else None
+
+def cache_set_json(key: str, value, ttl: int):
+    """Store a JSON value in Redis for ``ttl`` seconds, best effort"""
+    try:
+        get_redis_client().setex(key, ttl, orjson.dumps(value))
+    except redis.RedisError as e:
+        logger.warning("Error writing cache key %s: %s", key, e)
+
+def ttl_cache(seconds: float):
+    """Cache a function's result per positional-argument tuple for ``seconds``.
+
+    Intended for cheap-to-stale, expensive-to-compute values (dashboard
+    statistics, service availability). Exceptions are not cached.
+    """
+    def decorator(func):
+        cache = {}
+        lock = threading.Lock()
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            now = time.monotonic()
+            with lock:
+                entry = cache.get(args)
+                if entry and entry[0] > now:
+                    return entry[1]
+
+            value = func(*args)
+
+            with lock:
+                cache[args] = (now + seconds, value)
+            return value
+
+        wrapper.cache_clear = cache.clear
+        return wrapper
+
+    return decorator
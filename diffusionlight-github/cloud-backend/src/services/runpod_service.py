@@ -1,12 +1,51 @@
 import os
+import hmac
 import requests
-import json
+import orjson
 import time
+import threading
 from typing import Dict, Any, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
+from src.services.cache import (
+    cache_get_json, cache_set_json, RUNPOD_STATUS_KEY, RUNPOD_STATUS_TTL
+)
 
 load_dotenv()
 
+# Seconds between finalize_hdri_task status checks; the last step repeats
+POLL_BACKOFF = (5, 10, 30, 60)
+
+# Previews requested from the worker: AVIF is several times smaller than
+# JPEG at the same visual quality
+PREVIEW_FORMAT = os.getenv('PREVIEW_FORMAT', 'avif')
+PREVIEW_QUALITY = int(os.getenv('PREVIEW_QUALITY', '60'))
+
+# Per-job completion callbacks: RunPod POSTs to
+# {CALLBACK_BASE_URL}/webhooks/runpod/callback/<job_id>?token=<hmac of job_id>
+# Only enabled with a real WEBHOOK_SECRET; tokens keyed with a public
+# default would let anyone finalize any job
+CALLBACK_BASE_URL = os.getenv('CALLBACK_BASE_URL', '').rstrip('/')
+_CALLBACK_KEY = os.getenv('WEBHOOK_SECRET', '').encode('utf-8')
+CALLBACKS_ENABLED = bool(CALLBACK_BASE_URL and _CALLBACK_KEY)
+
+def callback_token(job_id: str) -> str:
+    """HMAC token that authorizes RunPod's callback for one job"""
+    return hmac.digest(_CALLBACK_KEY, job_id.encode('utf-8'), 'sha256').hex()
+
+def verify_callback_token(job_id: str, token: Optional[str]) -> bool:
+    if not CALLBACKS_ENABLED or not token:
+        return False
+    # Compared as bytes: compare_digest rejects non-ASCII str
+    return hmac.compare_digest(callback_token(job_id).encode('ascii'), token.encode('utf-8'))
+
+def runpod_callback_url(job_id: str) -> Optional[str]:
+    """Completion callback URL for a job, or None if callbacks aren't configured"""
+    if not CALLBACKS_ENABLED:
+        return None
+    return f"{CALLBACK_BASE_URL}/webhooks/runpod/callback/{job_id}?token={callback_token(job_id)}"
+
 class RunPodService:
     """Service for integrating with RunPod for GPU processing"""
     
@@ -18,13 +57,34 @@ class RunPodService:
             'Authorization': f'Bearer {self.api_key}',
             'Content-Type': 'application/json'
         }
+        self._session = self._create_session()
+    
+    def _create_session(self) -> requests.Session:
+        """Keep-alive session so polls reuse the TCP/TLS connection.
+        
+        Retry's default allowed_methods exclude POST, so /run submissions
+        are never replayed; only status GETs are retried on gateway errors.
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=20,
+            max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+        )
+        session.mount('https://', adapter)
+        session.headers.update(self.headers)
+        return session
     
     def is_available(self) -> bool:
         """Check if RunPod service is available"""
         return bool(self.api_key and self.endpoint_id)
     
-    def submit_job(self, input_data: Dict[str, Any]) -> Optional[str]:
-        """Submit a job to RunPod endpoint"""
+    def submit_job(self, input_data: Dict[str, Any], webhook_url: Optional[str] = None) -> Optional[str]:
+        """Submit a job to RunPod endpoint.
+        
+        With ``webhook_url`` RunPod POSTs the final job status there when
+        the job finishes.
+        """
         if not self.is_available():
             raise Exception("RunPod service not configured")
         
@@ -33,9 +93,12 @@ class RunPodService:
         payload = {
             "input": input_data
         }
+        if webhook_url:
+            payload["webhook"] = webhook_url
         
         try:
-            response = requests.post(url, headers=self.headers, json=payload)
+            # Content-Type: application/json is already a session header
+            response = self._session.post(url, data=orjson.dumps(payload))
             response.raise_for_status()
             
             result = response.json()
@@ -46,17 +109,28 @@ class RunPodService:
             return None
     
     def get_job_status(self, job_id: str) -> Optional[Dict[str, Any]]:
-        """Get job status from RunPod"""
+        """Get job status from RunPod.
+        
+        Responses are cached in Redis for RUNPOD_STATUS_TTL seconds so
+        concurrent watchers of one job share a single API call.
+        """
         if not self.is_available():
             return None
         
+        cache_key = RUNPOD_STATUS_KEY.format(job_id)
+        cached = cache_get_json(cache_key)
+        if cached is not None:
+            return cached
+        
         url = f"{self.base_url}/{self.endpoint_id}/status/{job_id}"
         
         try:
-            response = requests.get(url, headers=self.headers)
+            response = self._session.get(url)
             response.raise_for_status()
             
-            return response.json()
+            result = response.json()
+            cache_set_json(cache_key, result, RUNPOD_STATUS_TTL)
+            return result
             
         except requests.exceptions.RequestException as e:
             print(f"Error getting job status from RunPod: {e}")
@@ -70,7 +144,7 @@ class RunPodService:
         url = f"{self.base_url}/{self.endpoint_id}/cancel/{job_id}"
         
         try:
-            response = requests.post(url, headers=self.headers)
+            response = self._session.post(url)
             response.raise_for_status()
             return True
             
@@ -78,27 +152,6 @@ class RunPodService:
             print(f"Error canceling job on RunPod: {e}")
             return False
     
-    def wait_for_completion(self, job_id: str, timeout: int = 600, poll_interval: int = 5) -> Optional[Dict[str, Any]]:
-        """Wait for job completion with polling"""
-        start_time = time.time()
-        
-        while time.time() - start_time < timeout:
-            status = self.get_job_status(job_id)
-            
-            if not status:
-                return None
-            
-            job_status = status.get('status')
-            
-            if job_status == 'COMPLETED':
-                return status
-            elif job_status in ['FAILED', 'CANCELLED']:
-                return status
-            
-            time.sleep(poll_interval)
-        
-        return None  # Timeout
-    
     def prepare_diffusionlight_input(self, image_url: str, configuration: Dict[str, Any]) -> Dict[str, Any]:
         """Prepare input data for DiffusionLight processing"""
         return {
@@ -112,6 +165,8 @@ class RunPodService:
             },
             "output_settings": {
                 "return_urls": True,
+                "preview_format": PREVIEW_FORMAT,
+                "preview_quality": PREVIEW_QUALITY,
                 "webhook_url": os.getenv('WEBHOOK_URL')  # For async notifications
             }
         }
@@ -121,44 +176,55 @@ class MockRunPodService:
     
     def __init__(self):
         self.jobs = {}
+        self._lock = threading.Lock()
     
     def is_available(self) -> bool:
         return True
     
-    def submit_job(self, input_data: Dict[str, Any]) -> str:
-        """Submit a mock job"""
+    def submit_job(self, input_data: Dict[str, Any], webhook_url: Optional[str] = None) -> str:
+        """Submit a mock job (the mock never calls ``webhook_url``)"""
         import uuid
         job_id = str(uuid.uuid4())
         
-        self.jobs[job_id] = {
-            'id': job_id,
-            'status': 'IN_QUEUE',
-            'input': input_data,
-            'created_at': time.time()
-        }
+        with self._lock:
+            self.jobs[job_id] = {
+                'id': job_id,
+                'status': 'IN_QUEUE',
+                'input': input_data,
+                'created_at': time.monotonic()
+            }
         
         return job_id
     
     def get_job_status(self, job_id: str) -> Optional[Dict[str, Any]]:
-        """Get mock job status with simulated progression"""
-        if job_id not in self.jobs:
+        """Get mock job status with simulated progression.
+        
+        The status is derived from the job's age on each call; the stored
+        job is never written here, so concurrent callers need no lock.
+        """
+        job = self.jobs.get(job_id)
+        if job is None:
             return None
         
-        job = self.jobs[job_id]
-        elapsed = time.time() - job['created_at']
+        if job['status'] == 'CANCELLED':
+            return dict(job)
+        
+        elapsed = time.monotonic() - job['created_at']
         
         # Simulate job progression
         if elapsed < 10:
-            status = 'IN_QUEUE'
+            return {**job, 'status': 'IN_QUEUE'}
         elif elapsed < 30:
-            status = 'IN_PROGRESS'
-        else:
-            status = 'COMPLETED'
-            # Add mock output
-            job['output'] = {
+            return {**job, 'status': 'IN_PROGRESS'}
+        
+        # Add mock output
+        return {
+            **job,
+            'status': 'COMPLETED',
+            'output': {
                 'result_urls': [
                     'https://example.com/result.hdr',
-                    'https://example.com/preview.jpg'
+                    f'https://example.com/preview.{PREVIEW_FORMAT}'
                 ],
                 'metadata': {
                     'processing_time': elapsed,
@@ -166,36 +232,17 @@ class MockRunPodService:
                     'format': job['input']['configuration']['output_format']
                 }
             }
-        
-        job['status'] = status
-        return job
+        }
     
     def cancel_job(self, job_id: str) -> bool:
         """Cancel mock job"""
-        if job_id in self.jobs:
-            self.jobs[job_id]['status'] = 'CANCELLED'
-            return True
+        with self._lock:
+            if job_id in self.jobs:
+                # Swap in a new dict so readers never see a half-updated job
+                self.jobs[job_id] = {**self.jobs[job_id], 'status': 'CANCELLED'}
+                return True
         return False
     
-    def wait_for_completion(self, job_id: str, timeout: int = 600, poll_interval: int = 5) -> Optional[Dict[str, Any]]:
-        """Wait for mock job completion"""
-        start_time = time.time()
-        
-        while time.time() - start_time < timeout:
-            status = self.get_job_status(job_id)
-            
-            if not status:
-                return None
-            
-            job_status = status.get('status')
-            
-            if job_status in ['COMPLETED', 'FAILED', 'CANCELLED']:
-                return status
-            
-            time.sleep(poll_interval)
-        
-        return None
-    
     def prepare_diffusionlight_input(self, image_url: str, configuration: Dict[str, Any]) -> Dict[str, Any]:
         """Prepare mock input data"""
         return {
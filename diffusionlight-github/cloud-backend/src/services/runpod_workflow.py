@@ -1,94 +1,125 @@
-import json
+import copy
 import os
+import orjson
+import functools
 from typing import Dict, Any
 
-class DiffusionLightWorkflow:
-    """Workflow configuration for DiffusionLight on RunPod"""
-    
-    def __init__(self):
-        self.workflow_template = self._load_workflow_template()
-    
-    def _load_workflow_template(self) -> Dict[str, Any]:
-        """Load the base DiffusionLight workflow template"""
-        workflow_path = os.path.join(
-            os.path.dirname(__file__), 
-            '../../workflows/diffusionlight-workflow.json'
-        )
-        
-        try:
-            with open(workflow_path, 'r') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            # Return a simplified workflow template if file not found
-            return self._get_default_workflow()
-    
-    def _get_default_workflow(self) -> Dict[str, Any]:
-        """Default workflow template for DiffusionLight"""
-        return {
-            "1": {
-                "inputs": {
-                    "image": "input_image_url",
-                    "upload": "image"
-                },
-                "class_type": "LoadImage",
-                "_meta": {
-                    "title": "Load Image"
-                }
+WORKFLOW_PATH = os.path.join(
+    os.path.dirname(__file__), 
+    '../../workflows/diffusionlight-workflow.json'
+)
+
+# Preset-specific configurations
+PRESET_CONFIGS = {
+    'automotivo': {
+        'exposure_stops': 2.5,
+        'tone_mapping': 'automotive',
+        'saturation': 1.2
+    },
+    'produto': {
+        'exposure_stops': 2.0,
+        'tone_mapping': 'product',
+        'saturation': 1.0
+    },
+    'arquitetonico': {
+        'exposure_stops': 3.0,
+        'tone_mapping': 'architectural',
+        'saturation': 0.9
+    }
+}
+
+# Per-option lookup tables; their keys are also the valid option values
+AA_MULTIPLIER = {'1': 1, '2': 2, '4': 4, '8': 8}
+
+# Processing time factors for estimate_processing_time
+RESOLUTION_FACTOR = {512: 0.5, 1024: 1.0, 2048: 2.5}
+AA_FACTOR = {'1': 0.7, '2': 1.0, '4': 1.5, '8': 2.5}
+FORMAT_FACTOR = {'hdr': 1.0, 'exr': 1.3, 'npy': 0.8}
+
+@functools.cache
+def _load_workflow_template() -> Dict[str, Any]:
+    """Load the base DiffusionLight workflow template (once per process)"""
+    try:
+        with open(WORKFLOW_PATH, 'rb') as f:
+            return orjson.loads(f.read())
+    except FileNotFoundError:
+        # Return a simplified workflow template if file not found
+        return _get_default_workflow()
+
+def _get_default_workflow() -> Dict[str, Any]:
+    """Default workflow template for DiffusionLight"""
+    return {
+        "1": {
+            "inputs": {
+                "image": "input_image_url",
+                "upload": "image"
             },
-            "2": {
-                "inputs": {
-                    "image": ["1", 0]
-                },
-                "class_type": "ChromeballMask",
-                "_meta": {
-                    "title": "Chromeball Mask"
-                }
+            "class_type": "LoadImage",
+            "_meta": {
+                "title": "Load Image"
+            }
+        },
+        "2": {
+            "inputs": {
+                "image": ["1", 0]
             },
-            "3": {
-                "inputs": {
-                    "image": ["1", 0],
-                    "mask": ["2", 0]
-                },
-                "class_type": "Ball2Envmap",
-                "_meta": {
-                    "title": "Ball to Environment Map"
-                }
+            "class_type": "ChromeballMask",
+            "_meta": {
+                "title": "Chromeball Mask"
+            }
+        },
+        "3": {
+            "inputs": {
+                "image": ["1", 0],
+                "mask": ["2", 0]
             },
-            "4": {
-                "inputs": {
-                    "image": ["3", 0],
-                    "exposure_stops": 2.0
-                },
-                "class_type": "ExposureBracket",
-                "_meta": {
-                    "title": "Exposure Bracket"
-                }
+            "class_type": "Ball2Envmap",
+            "_meta": {
+                "title": "Ball to Environment Map"
+            }
+        },
+        "4": {
+            "inputs": {
+                "image": ["3", 0],
+                "exposure_stops": 2.0
             },
-            "5": {
-                "inputs": {
-                    "images": ["4", 0]
-                },
-                "class_type": "Exposure2HDR",
-                "_meta": {
-                    "title": "Exposure to HDR"
-                }
+            "class_type": "ExposureBracket",
+            "_meta": {
+                "title": "Exposure Bracket"
+            }
+        },
+        "5": {
+            "inputs": {
+                "images": ["4", 0]
             },
-            "6": {
-                "inputs": {
-                    "image": ["5", 0],
-                    "filename_prefix": "diffusionlight_result",
-                    "format": "hdr"
-                },
-                "class_type": "SaveHDR",
-                "_meta": {
-                    "title": "Save HDR"
-                }
+            "class_type": "Exposure2HDR",
+            "_meta": {
+                "title": "Exposure to HDR"
+            }
+        },
+        "6": {
+            "inputs": {
+                "image": ["5", 0],
+                "filename_prefix": "diffusionlight_result",
+                "format": "hdr"
+            },
+            "class_type": "SaveHDR",
+            "_meta": {
+                "title": "Save HDR"
             }
         }
+    }
+
+class DiffusionLightWorkflow:
+    """Workflow configuration for DiffusionLight on RunPod"""
+    
+    # Shared, read-only template; create_workflow works on a deep copy
+    workflow_template = _load_workflow_template()
     
     def create_workflow(self, input_image_url: str, configuration: Dict[str, Any]) -> Dict[str, Any]:
         """Create a customized workflow based on configuration"""
-        workflow = self.workflow_template.copy()
+        # Deep copy: the node updates below mutate nested input dicts
+        workflow = copy.deepcopy(self.workflow_template)
         
         # Update input image
         if "1" in workflow:
@@ -100,26 +131,7 @@ class DiffusionLightWorkflow:
         output_format = configuration.get('output_format', 'hdr')
         anti_aliasing = configuration.get('anti_aliasing', '4')
         
-        # Preset-specific configurations
-        preset_configs = {
-            'automotivo': {
-                'exposure_stops': 2.5,
-                'tone_mapping': 'automotive',
-                'saturation': 1.2
-            },
-            'produto': {
-                'exposure_stops': 2.0,
-                'tone_mapping': 'product',
-                'saturation': 1.0
-            },
-            'arquitetonico': {
-                'exposure_stops': 3.0,
-                'tone_mapping': 'architectural',
-                'saturation': 0.9
-            }
-        }
-        
-        preset_config = preset_configs.get(preset, preset_configs['automotivo'])
+        preset_config = PRESET_CONFIGS.get(preset, PRESET_CONFIGS['automotivo'])
         
         # Update workflow nodes based on configuration
         self._update_exposure_bracket(workflow, preset_config['exposure_stops'])
@@ -157,12 +169,7 @@ class DiffusionLightWorkflow:
     def _update_quality_settings(self, workflow: Dict[str, Any], anti_aliasing: str):
         """Update quality and anti-aliasing settings"""
         # Add anti-aliasing configuration to relevant nodes
-        aa_multiplier = {
-            '1': 1,
-            '2': 2,
-            '4': 4,
-            '8': 8
-        }.get(anti_aliasing, 4)
+        aa_multiplier = AA_MULTIPLIER.get(anti_aliasing, 4)
         
         # Update nodes that support anti-aliasing
         for node_id, node in workflow.items():
@@ -216,27 +223,23 @@ class RunPodWorkflowManager:
         validated = {}
         
         # Preset validation
-        valid_presets = ['automotivo', 'produto', 'arquitetonico']
         validated['preset'] = configuration.get('preset', 'automotivo')
-        if validated['preset'] not in valid_presets:
+        if validated['preset'] not in PRESET_CONFIGS:
             validated['preset'] = 'automotivo'
         
         # Resolution validation
-        valid_resolutions = [512, 1024, 2048]
         validated['resolution'] = int(configuration.get('resolution', 1024))
-        if validated['resolution'] not in valid_resolutions:
+        if validated['resolution'] not in RESOLUTION_FACTOR:
             validated['resolution'] = 1024
         
         # Output format validation
-        valid_formats = ['hdr', 'exr', 'npy']
         validated['output_format'] = configuration.get('output_format', 'hdr')
-        if validated['output_format'] not in valid_formats:
+        if validated['output_format'] not in FORMAT_FACTOR:
             validated['output_format'] = 'hdr'
         
         # Anti-aliasing validation
-        valid_aa = ['1', '2', '4', '8']
         validated['anti_aliasing'] = str(configuration.get('anti_aliasing', '4'))
-        if validated['anti_aliasing'] not in valid_aa:
+        if validated['anti_aliasing'] not in AA_MULTIPLIER:
             validated['anti_aliasing'] = '4'
         
         return validated
@@ -245,29 +248,9 @@ class RunPodWorkflowManager:
         """Estimate processing time in seconds based on configuration"""
         base_time = 60  # 1 minute base
         
-        # Resolution factor
-        resolution = configuration.get('resolution', 1024)
-        resolution_factor = {
-            512: 0.5,
-            1024: 1.0,
-            2048: 2.5
-        }.get(resolution, 1.0)
-        
-        # Anti-aliasing factor
-        aa = configuration.get('anti_aliasing', '4')
-        aa_factor = {
-            '1': 0.7,
-            '2': 1.0,
-            '4': 1.5,
-            '8': 2.5
-        }.get(aa, 1.5)
-        
-        # Format factor
-        format_factor = {
-            'hdr': 1.0,
-            'exr': 1.3,
-            'npy': 0.8
-        }.get(configuration.get('output_format', 'hdr'), 1.0)
+        resolution_factor = RESOLUTION_FACTOR.get(configuration.get('resolution', 1024), 1.0)
+        aa_factor = AA_FACTOR.get(configuration.get('anti_aliasing', '4'), 1.5)
+        format_factor = FORMAT_FACTOR.get(configuration.get('output_format', 'hdr'), 1.0)
         
         estimated_time = int(base_time * resolution_factor * aa_factor * format_factor)
         return max(estimated_time, 30)  # Minimum 30 seconds
@@ -1,30 +1,70 @@
 import os
+from urllib.parse import urlsplit, urlunsplit
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# Celery Configuration
+def _with_redis_db(url: str, db: int) -> str:
+    """Return the Redis URL pointing at database ``db``"""
+    parts = urlsplit(url)
+    return urlunsplit(parts._replace(path=f'/{db}'))
+
+# Celery Configuration. Results live in their own Redis database so their
+# writes and expiry don't share a keyspace with broker traffic.
 broker_url = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
-result_backend = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+result_backend = os.getenv('REDIS_RESULT_URL', _with_redis_db(broker_url, 1))
+result_expires = 3600
+# Job state lives in the database, so task return values are only stored
+# for tasks that opt in (health_check_task); those are gzip-compressed
+task_ignore_result = True
+result_compression = 'gzip'
+result_backend_transport_options = {
+    'global_keyprefix': 'cr:',
+    'retry_policy': {'timeout': 5.0}
+}
+
+# Unacked tasks are redelivered after this long; keep it above task_time_limit
+broker_transport_options = {'visibility_timeout': 3600}
 
-# Task settings
-task_serializer = 'json'
-accept_content = ['json']
-result_serializer = 'json'
+# Task settings. msgpack gives smaller broker messages and faster
+# (de)serialization; json stays accepted for messages queued before the switch.
+task_serializer = 'msgpack'
+accept_content = ['msgpack', 'json']
+result_serializer = 'msgpack'
+result_accept_content = ['msgpack', 'json']
 timezone = 'UTC'
 enable_utc = True
 
 # Task routing
 task_routes = {
     'src.workers.tasks.process_hdri_task': {'queue': 'hdri_processing'},
+    'src.workers.tasks.finalize_hdri_task': {'queue': 'hdri_results'},
+    'src.workers.tasks.process_runpod_webhook': {'queue': 'webhooks'},
+    'src.workers.tasks.process_runpod_webhook_batch': {'queue': 'webhooks'},
     'src.workers.tasks.cleanup_old_files': {'queue': 'maintenance'},
+    'src.workers.tasks.flush_job_progress': {'queue': 'maintenance'},
+    'src.workers.tasks.reconcile_stuck_jobs': {'queue': 'maintenance'},
     'src.workers.tasks.health_check_task': {'queue': 'monitoring'},
 }
 
-# Worker settings
+# Worker settings. A prefetch of 1 keeps long HDRI jobs fairly spread across
+# workers; short-task queues should run in their own pools with a higher
+# prefetch so they don't pay a broker round-trip per task. Result downloads
+# (finalize_hdri_task) get their own queue so a pool sized for them can run
+# more, lighter processes:
+#   celery -A src.workers.tasks worker -Q hdri_processing --prefetch-multiplier=1 --concurrency=4
+#   celery -A src.workers.tasks worker -Q hdri_results --prefetch-multiplier=1 --concurrency=8 --max-memory-per-child=300000
+#   celery -A src.workers.tasks worker -Q webhooks --prefetch-multiplier=32
+#   celery -A src.workers.tasks worker -Q monitoring,maintenance --prefetch-multiplier=16 --concurrency=2
+# Nothing blocks waiting on RunPod any more (completion arrives by callback
+# or a scheduled retry), so the default prefork pool needs no gevent variant.
 worker_prefetch_multiplier = 1
 task_acks_late = True
-worker_max_tasks_per_child = 1000
+# Recycle worker processes regularly so memory freed by large tasks (result
+# downloads, cleanup batches) goes back to the OS, and replace any process
+# whose resident memory passes 500MB (in KiB) after its current task
+worker_max_tasks_per_child = 20
+worker_max_memory_per_child = 500000
 
 # Task time limits
 task_soft_time_limit = 600  # 10 minutes
@@ -40,6 +80,14 @@ beat_schedule = {
         'task': 'src.workers.tasks.cleanup_old_files',
         'schedule': 86400.0,  # Run daily
     },
+    'flush-job-progress': {
+        'task': 'src.workers.tasks.flush_job_progress',
+        'schedule': 5.0,      # Coalesce progress webhooks every 5 seconds
+    },
+    'reconcile-stuck-jobs': {
+        'task': 'src.workers.tasks.reconcile_stuck_jobs',
+        'schedule': 300.0,    # Catch RunPod callbacks that never arrived
+    },
     'health-check': {
         'task': 'src.workers.tasks.health_check_task',
         'schedule': 300.0,    # Run every 5 minutes
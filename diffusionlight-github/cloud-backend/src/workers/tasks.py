@@ -1,10 +1,27 @@
 import os
 import time
-from datetime import datetime
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import redis
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from celery import Celery
-from src.config.database import db, get_supabase_client
+from sqlalchemy import and_, case, func, null, or_, select, update
+from src.config.database import db, SupabaseStorage
 from src.models.job import Job
-from src.services.runpod_service import get_runpod_service
+from src.services.runpod_service import (
+    get_runpod_service, runpod_callback_url, RunPodService, POLL_BACKOFF, CALLBACKS_ENABLED,
+    PREVIEW_FORMAT
+)
+from src.services.runpod_workflow import RunPodWorkflowManager
+from src.services.cache import (
+    get_redis_client, set_job_progress, JOB_PROGRESS_PATTERN, RUNPOD_STATUS_KEY
+)
+
+logger = logging.getLogger(__name__)
 
 # Initialize Celery
 celery_app = Celery('diffusionlight')
@@ -12,42 +29,165 @@ celery_app.config_from_object('src.workers.celery_config')
 
 # Initialize services
 runpod_service = get_runpod_service()
+# One storage wrapper per worker process for all downloads and cleanups
+storage = SupabaseStorage()
+
+# Only the real service is polled from a separate task: the mock keeps its
+# jobs in process memory, so mock mode simulates processing inline instead
+USE_RUNPOD = isinstance(runpod_service, RunPodService) and runpod_service.is_available()
+
+# Result downloads are streamed in 1MB chunks and spill to disk above 16MB
+RESULT_CHUNK_SIZE = 1024 * 1024
+RESULT_SPOOL_SIZE = 16 * 1024 * 1024
+RESULT_DOWNLOAD_TIMEOUT = 60  # seconds
+
+def _create_download_session() -> requests.Session:
+    """Keep-alive session so result files from one CDN host reuse connections"""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=32,
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+    )
+    session.mount('https://', adapter)
+    return session
+
+_download_session = _create_download_session()
+
+# (offset, signature, extension) of each result format, checked against
+# the first chunk
+RESULT_MAGIC = (
+    (0, b'#?RADIANCE', 'hdr'),
+    (0, b'#?RGBE', 'hdr'),
+    (0, b'\x76\x2f\x31\x01', 'exr'),
+    (4, b'ftypavif', 'avif'),
+    (8, b'WEBP', 'webp'),
+    (0, b'\xff\xd8\xff', 'jpg'),
+    (0, b'\x93NUMPY', 'npy'),
+)
+
+# Result files downloaded concurrently per job
+RESULT_DOWNLOAD_WORKERS = 8
+
+# Seconds each simulated mock step sleeps; 0 runs mock jobs instantly
+# (set it, e.g. to 2, for a demo-paced progress bar)
+MOCK_STEP_SLEEP = float(os.getenv('MOCK_STEP_SLEEP', '0'))
+
+# Give up on a RunPod job this long after it started
+RUNPOD_TIMEOUT = 600  # 10 minutes
+
+# Jobs in these states are final; late or redelivered webhooks are ignored
+TERMINAL_JOB_STATUSES = ('completed', 'failed', 'cancelled')
+
+# cleanup_old_files deletes result files this long after a job completes
+RESULT_RETENTION = timedelta(days=30)
+
+# A reused job shares the prior job's stored files and loses them when the
+# prior job's retention ends. Only recent priors holding their own files
+# (never other reused jobs) are reused, so the files outlive the reusing
+# job's completion by at least 23 days. Reused jobs also complete, so a few
+# candidates are scanned past them to find an original.
+DEDUPE_MAX_AGE = timedelta(days=7)
+DEDUPE_CANDIDATES = 20
+
+# A finalize claim older than this belongs to a worker that died (it is
+# past task_time_limit) and may be taken over
+FINALIZE_CLAIM_TTL = timedelta(minutes=15)
+
+# A processing job still without a RunPod id after this lost its worker
+# between the claim and the submission (it is past task_time_limit)
+SUBMIT_TIMEOUT = timedelta(minutes=15)
+
+def utcnow():
+    """Naive UTC timestamp, matching the DateTime columns"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
 @celery_app.task(bind=True)
 def process_hdri_task(self, job_id, runpod_job_id=None):
-    """Process HDRI generation task"""
+    """Process HDRI generation task.
+    
+    RunPod jobs are submitted and handed to finalize_hdri_task, so this
+    worker is free again as soon as the submission is recorded.
+    """
     
     # Import here to avoid circular imports
     from src.main import app
     
     with app.app_context():
-        job = Job.query.get(job_id)
+        # Mark the job processing in one UPDATE and commit it before anything
+        # is submitted, so a fast RunPod callback or webhook always finds a
+        # started job. Only pending jobs are claimed: a redelivered task
+        # leaves a job that is already running or finished alone.
+        claimable = Job.status == 'pending'
+        if runpod_job_id:
+            # Messages queued by the old create_job, which submitted to
+            # RunPod itself and marked the job processing; only the lookup
+            # key is still missing
+            claimable = or_(claimable, and_(Job.status == 'processing', Job.external_job_id.is_(None)))
+        result = db.session.execute(
+            update(Job)
+            .where(Job.id == job_id, claimable)
+            .values(status='processing', started_at=func.coalesce(Job.started_at, utcnow()), progress=10)
+        )
+        db.session.commit()
+        
+        job = db.session.get(Job, job_id)
         if not job:
             return {'error': 'Job not found'}
+        if not result.rowcount:
+            return {'job_id': job_id, 'status': job.status, 'skipped': True}
         
         try:
-            job.status = 'processing'
-            job.started_at = datetime.utcnow()
-            job.progress = 10
-            db.session.commit()
+            # Reuse the results of an identical job instead of reprocessing
+            prior = find_duplicate_job(job)
+            if prior:
+                result = {
+                    'success': True,
+                    'files': prior.result_files,
+                    'metadata': {'deduplicated_from': prior.id}
+                }
+                finish_job(job, result)
+                db.session.commit()
+                return result
             
-            if runpod_job_id and runpod_service.is_available():
-                # Process with RunPod
-                result = process_with_runpod(job, runpod_job_id, self)
-            else:
-                # Process with mock/local
-                result = process_with_mock(job, self)
+            # Submit to RunPod (moved off the API request path)
+            if not runpod_job_id and USE_RUNPOD:
+                runpod_input = runpod_service.prepare_diffusionlight_input(
+                    image_url=job.input_file.public_url,
+                    configuration=job.configuration or {}
+                )
+                runpod_job_id = runpod_service.submit_job(
+                    runpod_input,
+                    webhook_url=runpod_callback_url(job.id)
+                )
+                
+                if not runpod_job_id:
+                    job.status = 'failed'
+                    job.error_message = 'Failed to submit job to RunPod'
+                    job.completed_at = utcnow()
+                    db.session.commit()
+                    return {'error': job.error_message}
             
-            if result['success']:
-                job.status = 'completed'
-                job.completed_at = datetime.utcnow()
-                job.processing_time = (job.completed_at - job.started_at).total_seconds()
-                job.progress = 100
-                job.set_result_files(result['files'])
-            else:
-                job.status = 'failed'
-                job.error_message = result.get('error', 'Unknown error')
-                job.completed_at = datetime.utcnow()
+            if runpod_job_id:
+                # Only the lookup key is written: the callback may already
+                # have finished the job, and its status must stand
+                db.session.execute(
+                    update(Job)
+                    .where(Job.id == job_id)
+                    .values(external_job_id=runpod_job_id)
+                )
+                db.session.commit()
+            
+            if runpod_job_id and USE_RUNPOD:
+                # RunPod's completion callback enqueues finalize_hdri_task;
+                # without a callback URL fall back to polling from there
+                if not CALLBACKS_ENABLED:
+                    finalize_hdri_task.apply_async((job_id,), countdown=POLL_BACKOFF[0])
+                return {'job_id': job_id, 'runpod_job_id': runpod_job_id}
+            
+            # Process with mock/local
+            result = process_with_mock(job, self)
+            finish_job(job, result)
             
             db.session.commit()
             return result
@@ -55,110 +195,423 @@ def process_hdri_task(self, job_id, runpod_job_id=None):
         except Exception as e:
             job.status = 'failed'
             job.error_message = str(e)
-            job.completed_at = datetime.utcnow()
+            job.completed_at = utcnow()
             db.session.commit()
             return {'error': str(e)}
 
-def process_with_runpod(job, runpod_job_id, task):
-    """Process job using RunPod"""
-    try:
-        # Monitor RunPod job progress
-        start_time = time.time()
-        timeout = 600  # 10 minutes timeout
-        
-        while time.time() - start_time < timeout:
-            # Update progress
-            elapsed = time.time() - start_time
-            progress = min(10 + int(elapsed / timeout * 80), 90)
+@celery_app.task(bind=True, max_retries=None)
+def finalize_hdri_task(self, job_id, runpod_payload=None):
+    """Collect a RunPod job's results once it has finished.
+    
+    ``runpod_payload`` is the job status RunPod posted to the completion
+    callback. Without it the status is fetched from the API; if the job is
+    still running the task re-schedules itself through Celery retries on
+    the POLL_BACKOFF schedule when callbacks aren't configured, and
+    otherwise leaves the job to the callback or reconcile_stuck_jobs. If
+    the job already finished this is a no-op.
+    """
+    
+    # Import here to avoid circular imports
+    from src.main import app
+    
+    with app.app_context():
+        job = db.session.get(Job, job_id)
+        if not job or job.status in TERMINAL_JOB_STATUSES:
+            return {'job_id': job_id, 'skipped': True}
+        
+        status = runpod_payload or runpod_service.get_job_status(job.external_job_id)
+        runpod_status = status.get('status') if status else None
+        elapsed = (utcnow() - job.started_at).total_seconds() if job.started_at else 0
+        
+        if runpod_status not in ('COMPLETED', 'FAILED', 'CANCELLED') and elapsed < RUNPOD_TIMEOUT:
+            if CALLBACKS_ENABLED:
+                return {'job_id': job_id, 'status': runpod_status}
+            retries = self.request.retries
+            raise self.retry(countdown=POLL_BACKOFF[min(retries, len(POLL_BACKOFF) - 1)])
+        
+        # Callback, webhook and reconcile_stuck_jobs can each enqueue a
+        # finalize for the same job; only the one that claims it collects
+        if not claim_finalize(job_id):
+            return {'job_id': job_id, 'skipped': True}
+        
+        try:
+            if runpod_status == 'COMPLETED':
+                result = collect_runpod_results(job, status)
+            elif runpod_status in ('FAILED', 'CANCELLED'):
+                result = {'success': False, 'error': status.get('error', 'RunPod job failed')}
+            else:
+                result = {'success': False, 'error': 'Processing timeout'}
             
-            job.progress = progress
+            finish_job(job, result)
+            db.session.commit()
+            return result
+            
+        except Exception as e:
+            job.status = 'failed'
+            job.error_message = str(e)
+            job.completed_at = utcnow()
             db.session.commit()
+            return {'error': str(e)}
+
+def claim_finalize(job_id):
+    """Claim a processing job for result collection with one conditional UPDATE.
+    
+    Returns False if another finalizer holds a live claim or the job has
+    already finished.
+    """
+    now = utcnow()
+    result = db.session.execute(
+        update(Job)
+        .where(
+            Job.id == job_id,
+            Job.status.notin_(TERMINAL_JOB_STATUSES),
+            or_(Job.finalize_claimed_at.is_(None), Job.finalize_claimed_at < now - FINALIZE_CLAIM_TTL)
+        )
+        .values(finalize_claimed_at=now)
+    )
+    db.session.commit()
+    return bool(result.rowcount)
+
+def find_duplicate_job(job):
+    """Recent completed job with the same input image and configuration.
+    
+    Only jobs whose result files were all copied into storage under their
+    own results/<id>/ prefix qualify. Results that still point at RunPod or
+    mock URLs, and jobs that themselves reused another job's files, aren't
+    reused.
+    """
+    if not job.input_hash or not job.config_hash:
+        return None
+    
+    candidates = db.session.execute(
+        select(Job)
+        .where(
+            Job.input_hash == job.input_hash,
+            Job.config_hash == job.config_hash,
+            Job.status == 'completed',
+            Job.completed_at >= utcnow() - DEDUPE_MAX_AGE,
+            Job.result_files.isnot(None),
+            Job.id != job.id
+        )
+        .order_by(Job.completed_at.desc())
+        .limit(DEDUPE_CANDIDATES)
+    ).scalars()
+    
+    for prior in candidates:
+        prefix = f"results/{prior.id}/"
+        if prior.result_files and all(
+            (f.get('storage_path') or '').startswith(prefix) for f in prior.result_files
+        ):
+            return prior
+    
+    return None
+
+def finish_job(job, result):
+    """Record a processing result on the job; the caller commits"""
+    job.completed_at = utcnow()
+    
+    if result['success']:
+        job.status = 'completed'
+        if job.started_at:
+            job.processing_time = (job.completed_at - job.started_at).total_seconds()
+        job.progress = 100
+        job.result_files = result['files']
+    else:
+        job.status = 'failed'
+        job.error_message = result.get('error', 'Unknown error')
+
+# Expired jobs cleared per transaction by cleanup_old_files, and rows
+# fetched from the cursor at a time within a batch
+CLEANUP_BATCH_SIZE = 1000
+CLEANUP_FETCH_SIZE = 200
+
+@celery_app.task
+def process_runpod_webhook(runpod_job_id, status, output=None, error=None, progress=None):
+    """Apply a RunPod webhook event to its job.
+    
+    Idempotent per (runpod_job_id, status): once a job reaches a terminal
+    state, redelivered or out-of-order events leave it untouched.
+    """
+    
+    # Import here to avoid circular imports
+    from src.main import app
+    
+    with app.app_context():
+        job = Job.query.filter_by(external_job_id=runpod_job_id).first()
+        
+        if not job:
+            logger.warning("Received webhook for unknown job: %s", runpod_job_id)
+            return {'error': 'Job not found'}
+        
+        if job.status in TERMINAL_JOB_STATUSES:
+            return {'job_id': job.id, 'status': job.status, 'skipped': True}
+        
+        try:
+            if apply_webhook_event(job, status, output, error, progress, utcnow()):
+                db.session.commit()
             
-            # Check RunPod status
-            status = runpod_service.get_job_status(runpod_job_id)
+            if status == 'COMPLETED':
+                finalize_completed_job(job.id)
             
-            if not status:
-                time.sleep(5)
-                continue
+            if job.status in TERMINAL_JOB_STATUSES:
+                drop_cached_runpod_status(runpod_job_id)
             
-            runpod_status = status.get('status')
+            return {'job_id': job.id, 'status': job.status}
             
-            if runpod_status == 'COMPLETED':
-                # Process completed successfully
-                output = status.get('output', {})
-                result_urls = output.get('result_urls', [])
-                
-                # Download and store results
-                result_files = []
-                for i, url in enumerate(result_urls):
-                    file_info = download_and_store_result(url, job.id, f"result_{i}")
-                    if file_info:
-                        result_files.append(file_info)
-                
-                return {
-                    'success': True,
-                    'files': result_files,
-                    'metadata': output.get('metadata', {})
-                }
+        except Exception as e:
+            db.session.rollback()
+            logger.exception("Error processing webhook for job %s", runpod_job_id)
+            return {'error': str(e)}
+
+@celery_app.task
+def process_runpod_webhook_batch(events):
+    """Apply a batch of RunPod webhook events with one lookup and one commit.
+    
+    ``events`` is a list of dicts with the webhook's id, status, output,
+    error and progress fields, applied in order.
+    """
+    
+    # Import here to avoid circular imports
+    from src.main import app
+    
+    with app.app_context():
+        runpod_job_ids = {event['id'] for event in events}
+        jobs = {
+            job.external_job_id: job
+            for job in Job.query.filter(Job.external_job_id.in_(runpod_job_ids))
+        }
+        
+        try:
+            changed = False
+            applied = 0
+            completed = {}
+            now = utcnow()
+            
+            for event in events:
+                job = jobs.get(event['id'])
+                if not job or job.status in TERMINAL_JOB_STATUSES:
+                    continue
                 
-            elif runpod_status in ['FAILED', 'CANCELLED']:
-                error_msg = status.get('error', 'RunPod job failed')
-                return {'success': False, 'error': error_msg}
+                if apply_webhook_event(job, event.get('status'), event.get('output'),
+                                       event.get('error'), event.get('progress'), now):
+                    changed = True
+                if event.get('status') == 'COMPLETED':
+                    completed[job.id] = job
+                applied += 1
             
-            time.sleep(5)
-        
-        # Timeout
-        return {'success': False, 'error': 'Processing timeout'}
+            # Read the final states before the commit expires them
+            to_finalize = [
+                job_id for job_id, job in completed.items()
+                if job.status not in TERMINAL_JOB_STATUSES
+            ]
+            finished = [
+                runpod_job_id for runpod_job_id, job in jobs.items()
+                if job.status in TERMINAL_JOB_STATUSES
+            ]
+            
+            if changed:
+                db.session.commit()
+            
+            # Enqueued after the commit so finalize sees this batch's updates
+            for job_id in to_finalize:
+                finalize_completed_job(job_id)
+            
+            for runpod_job_id in finished:
+                drop_cached_runpod_status(runpod_job_id)
+            
+            return {
+                'received': len(events),
+                'applied': applied,
+                'unknown_jobs': len(runpod_job_ids) - len(jobs)
+            }
+            
+        except Exception as e:
+            db.session.rollback()
+            logger.exception("Error processing webhook batch")
+            return {'error': str(e)}
+
+def apply_webhook_event(job, status, output=None, error=None, progress=None, now=None):
+    """Apply one RunPod event to a job; returns True if the row changed.
+    
+    COMPLETED events leave the row alone: the caller hands them to
+    finalize_completed_job once its other updates are committed.
+    """
+    now = now or utcnow()
+    
+    if status == 'COMPLETED':
+        return False
+    elif status == 'FAILED':
+        handle_failed_job(job, error, now)
+    elif status == 'IN_PROGRESS':
+        return handle_progress_update(job, progress, now)
+    elif status == 'CANCELLED':
+        handle_cancelled_job(job, now)
+    else:
+        return False
+    
+    return True
+
+def drop_cached_runpod_status(runpod_job_id):
+    """Drop a finished job's cached RunPod status so later reads see the final state"""
+    try:
+        get_redis_client().delete(RUNPOD_STATUS_KEY.format(runpod_job_id))
+    except redis.RedisError:
+        logger.exception("Error dropping cached status for RunPod job %s", runpod_job_id)
+
+def finalize_completed_job(job_id):
+    """Hand a completed RunPod job to finalize_hdri_task.
+    
+    The job is only marked completed once its result files have been
+    copied into storage, never with RunPod's temporary output URLs. The
+    webhook's own output isn't trusted: finalize reads the job's status
+    from the RunPod API.
+    """
+    finalize_hdri_task.delay(job_id)
+
+def handle_failed_job(job, error, now):
+    """Handle failed job webhook"""
+    job.status = 'failed'
+    job.completed_at = now
+    job.error_message = error or 'Job failed on RunPod'
+    
+    if job.started_at:
+        job.processing_time = (now - job.started_at).total_seconds()
+    
+    logger.info("Job %s failed: %s", job.id, error)
+
+def handle_progress_update(job, progress_info, now):
+    """Handle progress update webhook.
+    
+    Returns True if the job row changed. Plain progress ticks only update
+    Redis; flush_job_progress writes the latest values in bulk.
+    """
+    progress = None
+    
+    # Extract progress information
+    if isinstance(progress_info, dict):
+        percentage = progress_info.get('percentage')
         
-    except Exception as e:
-        return {'success': False, 'error': str(e)}
+        if isinstance(percentage, (int, float)):
+            progress = min(max(int(percentage), 0), 99)  # Keep between 0-99 until completion
+    
+    if job.status == 'pending':
+        job.status = 'processing'
+        job.started_at = now
+        if progress is not None:
+            job.progress = progress
+        return True
+    
+    if progress is None or set_job_progress(job.id, progress):
+        return False
+    
+    # Redis is unavailable; write the row directly
+    job.progress = progress
+    return True
+
+def handle_cancelled_job(job, now):
+    """Handle cancelled job webhook"""
+    job.status = 'cancelled'
+    job.completed_at = now
+    
+    if job.started_at:
+        job.processing_time = (now - job.started_at).total_seconds()
+    
+    logger.info("Job %s was cancelled", job.id)
+
+def collect_runpod_results(job, status):
+    """Download a completed RunPod job's outputs into storage"""
+    output = status.get('output') or {}
+    result_urls = list(output.get('result_urls') or [])
+    
+    # Webhook payloads list outputs under 'images', as URLs or {'url': ...}
+    for image_info in output.get('images') or []:
+        url = image_info.get('url') if isinstance(image_info, dict) else image_info
+        if url:
+            result_urls.append(url)
+    
+    # Download and store results concurrently; the work is network-bound
+    # and map() keeps the files in result_urls order
+    result_files = []
+    if result_urls:
+        with ThreadPoolExecutor(max_workers=min(RESULT_DOWNLOAD_WORKERS, len(result_urls))) as executor:
+            for file_info in executor.map(
+                download_and_store_result,
+                result_urls,
+                [job.id] * len(result_urls),
+                [f"result_{i}" for i in range(len(result_urls))]
+            ):
+                if file_info:
+                    result_files.append(file_info)
+    
+    return {
+        'success': True,
+        'files': result_files,
+        'metadata': output.get('metadata', {})
+    }
+
+# Simulated processing steps and the mock result files. String fields of
+# the file templates are filled with str.format_map per job.
+MOCK_STEPS = (
+    ("Validating input image", 20),
+    ("Detecting chrome ball", 40),
+    ("Converting to environment map", 60),
+    ("Applying tone mapping", 80),
+    ("Generating HDR file", 95),
+    ("Finalizing output", 100)
+)
+MOCK_RESULT_FILE = {
+    'filename': 'result_{job_id}.{format}',
+    'size': 1024 * 1024 * 5,  # 5MB mock size
+    'download_url': '/api/files/{job_id}/download',
+    'type': 'hdri',
+    'format': '{format}',
+    'resolution': '{width}x{height}'
+}
+MOCK_PREVIEW_FILE = {
+    'filename': f'preview_{{job_id}}.{PREVIEW_FORMAT}',
+    'size': 1024 * 128,  # 128KB mock size
+    'download_url': '/api/files/{job_id}/preview',
+    'type': 'preview',
+    'format': PREVIEW_FORMAT,
+    'resolution': '512x256'
+}
+
+def _fill_template(template, values):
+    """Copy a result file template, formatting its string fields with ``values``"""
+    return {
+        key: value.format_map(values) if isinstance(value, str) else value
+        for key, value in template.items()
+    }
 
 def process_with_mock(job, task):
     """Process job with mock/local processing"""
     try:
-        # Simulate processing steps
-        steps = [
-            ("Validating input image", 20),
-            ("Detecting chrome ball", 40),
-            ("Converting to environment map", 60),
-            ("Applying tone mapping", 80),
-            ("Generating HDR file", 95),
-            ("Finalizing output", 100)
-        ]
-        
-        for step_name, progress in steps:
+        # Progress is published through Redis (read by GET /api/jobs/<id> and
+        # flushed by flush_job_progress); process_hdri_task commits at the end
+        for step_name, progress in MOCK_STEPS:
             job.progress = progress
-            db.session.commit()
+            set_job_progress(job.id, progress)
             
             # Simulate processing time
-            time.sleep(2)
+            if MOCK_STEP_SLEEP:
+                time.sleep(MOCK_STEP_SLEEP)
         
         # Generate mock result files
-        config = job.get_configuration()
+        config = job.configuration or {}
         output_format = config.get('output_format', 'hdr')
         resolution = config.get('resolution', 1024)
+        values = {
+            'job_id': job.id,
+            'format': output_format,
+            'width': resolution,
+            'height': resolution // 2
+        }
         
-        result_files = [
-            {
-                'filename': f'result_{job.id}.{output_format}',
-                'size': 1024 * 1024 * 5,  # 5MB mock size
-                'download_url': f'/api/files/{job.id}/download',
-                'type': 'hdri',
-                'format': output_format,
-                'resolution': f'{resolution}x{resolution//2}'
-            }
-        ]
+        result_files = [_fill_template(MOCK_RESULT_FILE, values)]
         
         # Add preview if available
         if output_format in ['hdr', 'exr']:
-            result_files.append({
-                'filename': f'preview_{job.id}.jpg',
-                'size': 1024 * 512,  # 512KB mock size
-                'download_url': f'/api/files/{job.id}/preview',
-                'type': 'preview',
-                'format': 'jpg',
-                'resolution': '512x256'
-            })
+            result_files.append(_fill_template(MOCK_PREVIEW_FILE, values))
         
         return {
             'success': True,
@@ -173,40 +626,42 @@ def process_with_mock(job, task):
         return {'success': False, 'error': str(e)}
 
 def download_and_store_result(url, job_id, filename_prefix):
-    """Download result file from URL and store in Supabase"""
+    """Download result file from URL and store in Supabase.
+    
+    The download is streamed into a spooled temp file (in memory up to
+    RESULT_SPOOL_SIZE, then on disk) and the file handle is uploaded, so a
+    large HDR/EXR never sits in worker memory in full.
+    """
     try:
-        import requests
-        from src.config.database import SupabaseStorage
-        
-        storage = SupabaseStorage()
-        
         # Download file
-        response = requests.get(url, timeout=60)
-        response.raise_for_status()
-        
-        file_data = response.content
-        file_size = len(file_data)
-        
-        # Determine file extension from URL or content type
-        content_type = response.headers.get('content-type', '')
-        if 'hdr' in url.lower() or 'radiance' in content_type:
-            ext = 'hdr'
-        elif 'exr' in url.lower() or 'openexr' in content_type:
-            ext = 'exr'
-        elif 'jpg' in url.lower() or 'jpeg' in content_type:
-            ext = 'jpg'
-        else:
-            ext = 'bin'
-        
-        filename = f"{filename_prefix}_{job_id}.{ext}"
-        storage_path = f"results/{job_id}/{filename}"
-        
-        # Upload to Supabase Storage
-        upload_result = storage.upload_file(
-            file_path=storage_path,
-            file_data=file_data,
-            content_type=content_type
-        )
+        with _download_session.get(url, stream=True, timeout=RESULT_DOWNLOAD_TIMEOUT) as response, \
+                tempfile.SpooledTemporaryFile(max_size=RESULT_SPOOL_SIZE) as tmp:
+            response.raise_for_status()
+            
+            ext = None
+            file_size = 0
+            for chunk in response.iter_content(chunk_size=RESULT_CHUNK_SIZE):
+                if ext is None:
+                    # Sniff the format from the file itself; URLs and
+                    # query strings can name the wrong one
+                    ext = next((e for offset, magic, e in RESULT_MAGIC if chunk.startswith(magic, offset)), 'bin')
+                tmp.write(chunk)
+                file_size += len(chunk)
+            
+            ext = ext or 'bin'
+            content_type = response.headers.get('content-type', '')
+            
+            filename = f"{filename_prefix}_{job_id}.{ext}"
+            storage_path = f"results/{job_id}/{filename}"
+            
+            # Upload to Supabase Storage (resumable above 6MB)
+            tmp.seek(0)
+            upload_result = storage.upload_file(
+                file_path=storage_path,
+                file_data=tmp,
+                content_type=content_type,
+                file_size=file_size
+            )
         
         if upload_result:
             public_url = storage.get_public_url(storage_path)
@@ -222,52 +677,179 @@ def download_and_store_result(url, job_id, filename_prefix):
         
         return None
         
-    except Exception as e:
-        print(f"Error downloading and storing result: {e}")
+    except Exception:
+        logger.exception("Error downloading and storing result from %s", url)
         return None
 
 @celery_app.task
 def cleanup_old_files():
-    """Cleanup old files from storage"""
+    """Cleanup old files from storage.
+    
+    Walks expired jobs in primary-key order, CLEANUP_BATCH_SIZE at a time,
+    and clears each batch's result_files with one UPDATE and one commit so
+    no transaction holds row locks for long.
+    """
+    
+    # Import here to avoid circular imports
+    from src.main import app
+    
     try:
-        from datetime import timedelta
-        from src.config.database import SupabaseStorage
+        # Delete files older than RESULT_RETENTION
+        cutoff_date = utcnow() - RESULT_RETENTION
         
-        # Delete files older than 30 days
-        cutoff_date = datetime.utcnow() - timedelta(days=30)
+        deleted_count = 0
+        cleared_jobs = 0
+        last_id = ''
         
-        old_jobs = Job.query.filter(
-            Job.completed_at < cutoff_date,
-            Job.status.in_(['completed', 'failed'])
-        ).all()
+        with app.app_context():
+            while True:
+                # Stream the batch so only CLEANUP_FETCH_SIZE result_files
+                # blobs are in memory at once; keep just ids and paths
+                result = db.session.execute(
+                    select(Job.id, Job.result_files)
+                    .where(
+                        Job.id > last_id,
+                        Job.completed_at < cutoff_date,
+                        Job.status.in_(['completed', 'failed']),
+                        Job.result_files.isnot(None)
+                    )
+                    .order_by(Job.id)
+                    .limit(CLEANUP_BATCH_SIZE)
+                    .execution_options(yield_per=CLEANUP_FETCH_SIZE)
+                )
+                
+                job_ids = []
+                storage_paths = []
+                for row in result:
+                    job_ids.append(row.id)
+                    storage_paths.extend(
+                        file_info['storage_path']
+                        for file_info in row.result_files or []
+                        if file_info.get('storage_path')
+                    )
+                
+                if not job_ids:
+                    break
+                
+                # One bulk storage delete per batch instead of one per file
+                deleted_count += storage.delete_files(storage_paths)
+                
+                # Clear result files from the batch (SQL NULL, not JSON null)
+                db.session.execute(
+                    update(Job)
+                    .where(Job.id.in_(job_ids))
+                    .values(result_files=null())
+                    .execution_options(synchronize_session=False)
+                )
+                db.session.commit()
+                
+                cleared_jobs += len(job_ids)
+                last_id = job_ids[-1]
         
-        storage = SupabaseStorage()
-        deleted_count = 0
+        return {'deleted_files': deleted_count, 'cleared_jobs': cleared_jobs}
         
-        for job in old_jobs:
-            result_files = job.get_result_files()
-            
-            for file_info in result_files:
-                storage_path = file_info.get('storage_path')
-                if storage_path:
-                    if storage.delete_file(storage_path):
-                        deleted_count += 1
-            
-            # Clear result files from job
-            job.set_result_files([])
+    except Exception as e:
+        return {'error': str(e)}
+
+@celery_app.task
+def flush_job_progress():
+    """Write buffered progress values to the jobs table in one UPDATE"""
+    
+    # Import here to avoid circular imports
+    from src.main import app
+    
+    try:
+        client = get_redis_client()
+        keys = list(client.scan_iter(match=JOB_PROGRESS_PATTERN, count=500))
+        if not keys:
+            return {'updated': 0}
+        
+        # GETDEL so a tick that lands after the read is kept for the next flush
+        pipe = client.pipeline(transaction=False)
+        for key in keys:
+            pipe.getdel(key)
+        values = pipe.execute()
+        
+        progress_by_id = {
+            key.decode().split(':')[1]: int(value)
+            for key, value in zip(keys, values)
+            if value is not None
+        }
+        if not progress_by_id:
+            return {'updated': 0}
+        
+        with app.app_context():
+            result = db.session.execute(
+                update(Job)
+                .where(
+                    Job.id.in_(progress_by_id),
+                    Job.status.notin_(TERMINAL_JOB_STATUSES)
+                )
+                .values(progress=case(progress_by_id, value=Job.id))
+                .execution_options(synchronize_session=False)
+            )
             db.session.commit()
         
-        return {'deleted_files': deleted_count}
+        return {'updated': result.rowcount}
         
     except Exception as e:
         return {'error': str(e)}
 
 @celery_app.task
+def reconcile_stuck_jobs():
+    """Finalize RunPod jobs whose completion callback never arrived.
+    
+    Only jobs running longer than their estimated processing time are
+    checked, so a healthy job costs no status calls at all. Jobs whose
+    worker died before the RunPod submission was recorded are failed.
+    """
+    
+    # Import here to avoid circular imports
+    from src.main import app
+    
+    try:
+        with app.app_context():
+            now = utcnow()
+            abandoned = db.session.execute(
+                update(Job)
+                .where(
+                    Job.status == 'processing',
+                    Job.external_job_id.is_(None),
+                    Job.started_at < now - SUBMIT_TIMEOUT
+                )
+                .values(status='failed', error_message='Job submission interrupted', completed_at=now)
+            ).rowcount
+            db.session.commit()
+            
+            jobs = db.session.execute(
+                select(Job.id, Job.started_at, Job.configuration)
+                .where(
+                    Job.status == 'processing',
+                    Job.external_job_id.isnot(None)
+                )
+            ).all()
+        
+        workflow_manager = RunPodWorkflowManager()
+        stuck = [
+            job_id for job_id, started_at, configuration in jobs
+            if started_at and (now - started_at).total_seconds()
+            > workflow_manager.estimate_processing_time(configuration or {})
+        ]
+        
+        for job_id in stuck:
+            finalize_hdri_task.delay(job_id)
+        
+        return {'checked': len(jobs), 'finalizing': len(stuck), 'abandoned': abandoned}
+        
+    except Exception as e:
+        return {'error': str(e)}
+
+@celery_app.task(ignore_result=False)
 def health_check_task():
-    """Health check task for monitoring"""
+    """Health check task for monitoring (its result is read by monitoring)"""
     return {
         'status': 'healthy',
-        'timestamp': datetime.utcnow().isoformat(),
+        'timestamp': utcnow().isoformat(),
         'worker_id': os.getenv('HOSTNAME', 'unknown')
     }
 
@@ -37,7 +37,7 @@ function App() {
         listJobs(10),
         getStatistics()
       ])
-      setJobs(jobsData)
+      setJobs(jobsData.jobs)
       setStatistics(statsData)
     } catch (error) {
       console.error('Error loading dashboard data:', error)
@@ -107,8 +107,10 @@ export const useJobs = () => {
     return await apiCall(`/jobs/${jobId}`)
   }, [apiCall])
 
-  const listJobs = useCallback(async (limit = 50) => {
-    return await apiCall(`/jobs?limit=${limit}`)
+  const listJobs = useCallback(async (limit = 50, cursor = null) => {
+    const params = new URLSearchParams({ limit })
+    if (cursor) params.set('cursor', cursor)
+    return await apiCall(`/jobs?${params}`)
   }, [apiCall])
 
   const cancelJob = useCallback(async (jobId) => {